@@ -0,0 +1,90 @@
+# Login throughput for several password hash costs and pool sizes, and the latency of token
+# validations served by the same process during the login burst. Needs no database:
+#   python benchmarks/password_throughput.py
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ITERATIONS = [50000, 100000, 200000, 400000]
+WORKERS = [0, 1, 2, 4]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run(handler, stored, clients, logins):
+    from jwtHandler import jwtHandler
+    from passwordHandler import PasswordBusyError
+
+    done = threading.Event()
+    validations = []
+    rejected = []
+    key = b"benchmark"
+    token = jwtHandler.codec.encode({"name": "bob", "exp": 0}, key)
+
+    # what /users/validation does besides the key lookup
+    def validate():
+        while not done.is_set():
+            started = time.perf_counter()
+            payload, signing_input, signature = jwtHandler.codec.decode(token)
+            jwtHandler.codec.verify(signing_input, signature, key)
+            validations.append(time.perf_counter() - started)
+            time.sleep(0.001)
+
+    def login():
+        for _ in range(logins):
+            try:
+                handler.verify("pw", stored)
+            except PasswordBusyError:
+                rejected.append(1)
+
+    validator = threading.Thread(target=validate)
+    validator.start()
+    threads = [threading.Thread(target=login) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    validator.join()
+    return clients * logins / elapsed, len(rejected), validations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=10, help="logins per client")
+    args = parser.parse_args()
+
+    os.chdir(SRC)
+    sys.path.insert(0, SRC)
+    from passwordHandler import PasswordHandler, hash_password
+
+    print(f"{'iterations':>10} {'workers':>7} {'logins/s':>9} {'rejected':>8} "
+          f"{'validation p50 ms':>17} {'p99 ms':>8}")
+    for iterations in ITERATIONS:
+        stored = hash_password("pw", iterations)
+        for workers in WORKERS:
+            handler = PasswordHandler()
+            handler.iterations = iterations
+            handler.workers = workers
+            throughput, rejected, validations = run(handler, stored, args.clients, args.logins)
+            if handler.pool is not None:
+                handler.pool.shutdown()
+            print(
+                f"{iterations:>10} {workers:>7} {throughput:9.1f} {rejected:>8} "
+                f"{statistics.median(validations) * 1000:17.3f} "
+                f"{percentile(validations, 0.99) * 1000:8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,35 @@
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_cors import CORS, cross_origin
 from apiHandler import apiHandler
 from jwtHandler import jwtHandler
+from passwordHandler import PasswordBusyError
 
 app = Flask(__name__)
 cors = CORS(app) # cors is added in advance to allow cors requests
 app.config['CORS_HEADERS'] = 'Content-Type'
 
+@app.errorhandler(PasswordBusyError)
+def handle_password_busy(error):
+    return {"message": "server is busy, please try again later"}, 503
+
 @app.route('/users/', methods=["GET"])
 @cross_origin()
 def index():
-    return apiHandler.get_users()
+    get_data = request.args.to_dict()
+    after = get_data.get('after')
+    streamed = get_data.get('format') == 'ndjson'
+    # the streamed listing is unbounded unless a limit is given
+    default_limit = 0 if streamed else jwtHandler.config["user-page-size"]
+    try:
+        limit = int(get_data.get('limit', default_limit))
+    except ValueError:
+        return {"message": "limit must be an integer"}, 400
+    if streamed:
+        return Response(apiHandler.stream_users(after, max(limit, 0)), mimetype='application/x-ndjson')
+    limit = min(max(limit, 1), jwtHandler.config["user-page-size-max"])
+    users = list(apiHandler.get_users(after, limit))
+    next_after = users[-1] if len(users) == limit else None
+    return {"message": "users retrieved", "data": {"users": users, "next": next_after}}, 200
 
 @app.route('/users/create', methods=["POST"])
 @cross_origin()
@@ -23,7 +42,8 @@ def post_user():
             return {"message": "invalid username or password"}, 403
         if apiHandler.user_exists(username):
             return {"message": "user already exists"}, 409
-        apiHandler.handle_register(username, password)
+        if not apiHandler.handle_register(username, password):
+            return {"message": "user already exists"}, 409
         return {"message": "account created"}, 201
         
 @app.route('/users/update', methods=["PUT"])
@@ -76,4 +96,26 @@ def validation_check():
     if verify_result["verified"]:
         return {"message": "Authentication Successful", "data": {"name": verify_result["username"]}}, 200
     else:
-        return {"message": "Authentication Failed", "type": verify_result["message"]}, 401
\ No newline at end of file
+        return {"message": "Authentication Failed", "type": verify_result["message"]}, 401
+
+@app.route('/users/validation/batch', methods=["POST"])
+@cross_origin()
+def batch_validation_check():
+    get_data = request.get_json()
+    tokens = get_data.get('tokens') if isinstance(get_data, dict) else None
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        return {"message": "tokens must be a list of strings"}, 400
+    if len(tokens) > jwtHandler.config["batch-validation-limit"]:
+        return {"message": "too many tokens in one request"}, 413
+    results = []
+    for verify_result in apiHandler.verify_signitures(tokens):
+        if verify_result["verified"]:
+            results.append({"verified": True, "name": verify_result["username"]})
+        else:
+            results.append({"verified": False, "type": verify_result["message"]})
+    return {"message": "Batch validation finished", "data": {"results": results}}, 200
+
+@app.route('/users/validation/cache', methods=["GET"])
+@cross_origin()
+def validation_cache_stats():
+    return {"message": "signing key cache statistics", "data": jwtHandler.key_cache.stats()}, 200
\ No newline at end of file
@@ -1,7 +1,11 @@
 import calendar
+import secrets
 import time
+import pymongo
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from dbClient import mongo_client
 from jwtHandler import jwtHandler
+from passwordHandler import passwordHandler
 import json
 
 class ApiHandler(object):
@@ -9,68 +13,134 @@ class ApiHandler(object):
         self.client = mongo_client
         self.db = self.client.user_auth
         self.user_info = self.db.user_info
+        self.init_indexes()
         if not self.user_exists("admin"):
-            self.user_info.insert_one({"username": "admin", "password": "admin"})
+            self.handle_register("admin", "admin")
 
-    # retrieve all usernames stored in database
-    def get_users(self):
-        documents = self.user_info.find({})
-        keys = []
+    # usernames are unique, the index also backs every lookup by username. Registrations from
+    # before the index may hold duplicates, the build fails then and the service still starts,
+    # with register falling back to the user_exists check
+    def init_indexes(self):
+        try:
+            self.user_info.create_index("username", unique=True)
+        except OperationFailure as e:
+            print(f"WARNING: unique index on username not created, remove the duplicate users: {e}")
+
+    # retrieve usernames in ascending order after the given username (keyset pagination),
+    # the query is answered from the username index and a limit of 0 means no limit
+    def get_users(self, after=None, limit=0):
+        query = {} if after is None else {"username": {"$gt": after}}
+        documents = self.user_info.find(query, {"_id": 0, "username": 1}).sort(
+            "username", pymongo.ASCENDING
+        ).limit(limit)
         for document in documents:
-          keys.append(document['username'])
-        return json.dumps(keys, indent=2, ensure_ascii=False)
+            yield document["username"]
+
+    # write one JSON line per user as the cursor yields them, memory stays constant
+    def stream_users(self, after=None, limit=0):
+        for username in self.get_users(after, limit):
+            yield json.dumps({"username": username}, ensure_ascii=False) + "\n"
         
     def user_exists(self, username):
-        documents = self.user_info.find({})
-        for document in documents:
-            if document["username"] == username:
-                return True
-        return False
+        query = {"username": username}
+        # projecting only the indexed field lets mongo answer from the index alone
+        document = self.user_info.find_one(query, {"_id": 0, "username": 1})
+        return document is not None
     
+    # returns False if the username was registered concurrently
     def handle_register(self, username, password):
-        self.user_info.insert_one({"username": username, "password": password})
+        try:
+            self.user_info.insert_one({
+                "username": username,
+                "password": passwordHandler.hash(password),
+                "token_secret": secrets.token_hex(16),
+            })
+        except DuplicateKeyError:
+            return False
+        return True
     
     def handle_deletion(self, username):
         query = {"username": username}
         self.user_info.delete_one(query)
+        jwtHandler.invalidate_signing_key(username)
     
     def password_validated(self, username, password):
         query = {"username": username}
-        document = self.user_info.find_one(query)
+        document = self.user_info.find_one(query, {"_id": 0, "password": 1, "token_secret": 1})
         if document == None:
             return False
-        return document["password"] == password
+        stored = document["password"]
+        if not passwordHandler.verify(password, stored):
+            return False
+        if passwordHandler.needs_rehash(stored):
+            self.upgrade_password(username, stored, password, document.get("token_secret"))
+        return True
+
+    # replace a legacy plaintext or outdated hash, the filter on the old value avoids
+    # overwriting a password that was changed concurrently. A rehash keeps the token secret,
+    # so other sessions stay valid. A legacy user without one gets a new random secret, their
+    # key was derived from the plaintext password, which must not be kept
+    def upgrade_password(self, username, stored, password, token_secret=None):
+        query = {"username": username, "password": stored}
+        new_value = { "$set": {
+            "password": passwordHandler.hash(password),
+            "token_secret": secrets.token_hex(16) if token_secret is None else token_secret,
+        } }
+        self.user_info.update_one(query, new_value)
+        if token_secret is None:
+            jwtHandler.invalidate_signing_key(username)
         
+    # a new token secret revokes the tokens issued with the old password
     def handle_password_update(self, username, new_password):
         query = {"username": username}
-        new_value = { "$set": { "password": new_password } }
+        new_value = { "$set": {
+            "password": passwordHandler.hash(new_password),
+            "token_secret": secrets.token_hex(16),
+        } }
         self.user_info.update_one(query, new_value)
+        jwtHandler.invalidate_signing_key(username)
 
     def verify_signiture(self,token):
-        encoded_header, encoded_payload, encoded_signature = token.split('.')
+        parsed = self.parse_token(token)
+        if "verified" in parsed:
+            return parsed
+        verified = jwtHandler.verify_signature(parsed["signing_input"], parsed["signature"], username=parsed["username"])
+        return self.verification_result(parsed, verified)
+
+    # verify a list of tokens, the signing keys of all users are fetched at once
+    def verify_signitures(self, tokens):
+        parsed_tokens = [self.parse_token(token) for token in tokens]
+        usernames = [parsed["username"] for parsed in parsed_tokens if "verified" not in parsed]
+        keys = jwtHandler.get_signing_keys(usernames)
+        results = []
+        for parsed in parsed_tokens:
+            if "verified" in parsed:
+                results.append(parsed)
+                continue
+            verified = jwtHandler.verify_signature(
+                parsed["signing_input"], parsed["signature"], keys[parsed["username"]])
+            results.append(self.verification_result(parsed, verified))
+        return results
+
+    # decode the token, returns a failed verification result if it is malformed or expired
+    def parse_token(self, token):
         try:
-            # decode the base64url encoded string into a byte string, then decode it into a string
-            # the payload is of the form: {"name": "<username>"}
-            payload = jwtHandler.decode_base64url(encoded_payload).decode()
-            # convert the payload string into a json object    
-            user_name = json.loads(payload)['name']
-            exp_time = json.loads(payload)['exp']
+            # the payload is of the form: {"name": "<username>", "exp": <timestamp>}
+            payload, signing_input, signature = jwtHandler.codec.decode(token)
+            user_name = payload['name']
+            exp_time = payload['exp']
+            if not isinstance(user_name, str) or not isinstance(exp_time, (int, float)):
+                raise ValueError("unexpected payload types")
         except:
             return {"verified": False, "message": "Invalid payload"}
 
         if self.inactive_login(exp_time):
             return {"verified": False, "message": "Login expired."}
+        return {"username": user_name, "signing_input": signing_input, "signature": signature}
 
-        try:
-            # decode the signature in the request into a byte string
-            signature = jwtHandler.decode_base64url(encoded_signature)
-        except: 
-            return {"verified": False, "message": "Invalid signature"}
-        # generate the expected signature in the form of byte string based on the username
-        correct_signature = jwtHandler.generate_expected_signature(user_name, exp_time)
-
-        if signature == correct_signature:
-            return {"verified": True, "username": user_name}
+    def verification_result(self, parsed, verified):
+        if verified:
+            return {"verified": True, "username": parsed["username"]}
         else:
             return {"verified": False, "message": "Invalid signature"}
 
@@ -4,6 +4,78 @@ import json
 from dbClient import mongo_client
 import calendar
 import time
+import threading
+from collections import OrderedDict
+
+# bounded LRU cache of per-user signing keys, entries expire after ttl seconds
+# so that a password changed by another process is eventually picked up
+class SigningKeyCache(object):
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is None or entry[1] < time.monotonic():
+                self.entries.pop(username, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(username)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, username, key):
+        with self.lock:
+            self.entries[username] = (key, time.monotonic() + self.ttl)
+            self.entries.move_to_end(username)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self.lock:
+            self.entries.pop(username, None)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+# HS256 codec, the header never changes so its encoded segment is computed once
+# and verification runs over the raw "header.payload" bytes of the received token
+class JWTCodec(object):
+    def __init__(self, header):
+        self.header_segment = self.encode_base64url(json.dumps(header).encode())
+
+    def encode_base64url(self, raw):
+        return urlsafe_b64encode(raw).rstrip(b'=')
+
+    def decode_base64url(self, encoded):
+        return urlsafe_b64decode(encoded + b"=" * (-len(encoded) % 4))
+
+    def sign(self, signing_input, key):
+        # digest() returns the generated signature as a byte string
+        return hmac.new(key, signing_input, "SHA256").digest()
+
+    def encode(self, payload, key):
+        signing_input = self.header_segment + b"." + self.encode_base64url(json.dumps(payload).encode())
+        return (signing_input + b"." + self.encode_base64url(self.sign(signing_input, key))).decode()
+
+    # split the token and parse its payload once, raises ValueError if the token is malformed
+    def decode(self, token):
+        signing_input, _, encoded_signature = token.encode().rpartition(b".")
+        encoded_header, _, encoded_payload = signing_input.partition(b".")
+        if encoded_header != self.header_segment or b"." in encoded_payload:
+            raise ValueError("unexpected token header")
+        payload = json.loads(self.decode_base64url(encoded_payload))
+        signature = self.decode_base64url(encoded_signature)
+        return payload, signing_input, signature
+
+    def verify(self, signing_input, signature, key):
+        return hmac.compare_digest(self.sign(signing_input, key), signature)
 
 class JWTHandler(object):
     def __init__(self):
@@ -12,19 +84,64 @@ class JWTHandler(object):
         self.user_info = self.db.user_info
         # the algorithm used to generate the signature is HMAC SHA256
         self.header = {"alg": "HS256", "typ": "JWT"}
+        self.codec = JWTCodec(self.header)
         # the secret key used to sign the JWT
         self.secret = "ExtremeXPsecret20231209"
         self.file = open('../Config.json','r')
         self.config = json.load(self.file)
         self.file.close()
+        self.key_cache = SigningKeyCache(self.config["key-cache-size"], self.config["key-cache-ttl"])
     
-    # get the password of the user with the given username
-    def get_password(self, username):
+    # get the fields the signing key of the user is derived from
+    def get_key_document(self, username):
         query = {"username": username}
-        document = self.user_info.find_one(query)
-        if document == None:
-            return None
-        return document["password"]
+        return self.user_info.find_one(query, {"_id": 0, "password": 1, "token_secret": 1})
+
+    # get the HMAC key of the user, only unknown or expired users hit the database
+    def get_signing_key(self, username):
+        key = self.key_cache.get(username)
+        if key is not None:
+            return key
+        document = self.get_key_document(username)
+        key = self.derive_signing_key(document)
+        # unknown users are not cached, otherwise a later registration would keep the stale key
+        if document is not None:
+            self.key_cache.put(username, key)
+        return key
+
+    # get the HMAC keys of several users, the cache misses are resolved with a single $in query
+    def get_signing_keys(self, usernames):
+        keys = {}
+        missing = []
+        for username in set(usernames):
+            key = self.key_cache.get(username)
+            if key is None:
+                missing.append(username)
+            else:
+                keys[username] = key
+        if len(missing) > 0:
+            query = {"username": {"$in": missing}}
+            projection = {"_id": 0, "username": 1, "password": 1, "token_secret": 1}
+            for document in self.user_info.find(query, projection):
+                key = self.derive_signing_key(document)
+                self.key_cache.put(document["username"], key)
+                keys[document["username"]] = key
+        for username in missing:
+            keys.setdefault(username, self.derive_signing_key(None))
+        return keys
+
+    # the key is bound to the token secret of the user, which is replaced when the password
+    # changes so that all issued tokens are revoked. A rehash of the same password keeps it.
+    # Users registered before token secrets existed fall back to the stored password field.
+    def derive_signing_key(self, document):
+        if document is None:
+            return (self.secret + "None").encode()
+        material = document.get("token_secret", document.get("password"))
+        return (self.secret + str(material)).encode()
+
+    # drop the cached key after the password of the user changes or the user is deleted
+    def invalidate_signing_key(self, username):
+        self.key_cache.invalidate(username)
 
     # encode header, payload, and signature respectively and generate corresponding JWT
     # reference: https://jwt.io/introduction/ , https://docs.python.org/3/library/hmac.html
@@ -32,29 +149,14 @@ class JWTHandler(object):
         # the payload contains the subject's username, which is an immutable identifier for the user
         exp_timestamp = self.get_exp_timestamp()
         payload = {"name": "{}".format(username), "exp": exp_timestamp}
-        password = self.get_password(username)
-        dynamic_secret = self.secret + str(password)
-        encoded_header = urlsafe_b64encode(json.dumps(self.header).encode()).decode().rstrip('=') 
-        encoded_payload = urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
-        # digest() returns the generated signature as a byte string
-        signature = hmac.new(dynamic_secret.encode(), (encoded_header + "." + encoded_payload).encode(), "SHA256").digest()
-        encoded_signature = urlsafe_b64encode(signature).decode().rstrip('=')
-        return encoded_header + "." + encoded_payload + "." + encoded_signature
-
-    # generate the expected signature in the form of byte string based on the username
-
-    def generate_expected_signature(self, username, exp):
-        payload = {"name": "{}".format(username), "exp": exp}
-        password = self.get_password(username)
-        dynamic_secret = self.secret + str(password)
-        encoded_header = urlsafe_b64encode(json.dumps(self.header).encode()).decode().rstrip('=') 
-        encoded_payload = urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
-        signature = hmac.new(dynamic_secret.encode(), (encoded_header + "." + encoded_payload).encode(), "SHA256").digest()
-        return signature
-    
-    # decode the base64url encoded string into a byte string
-    def decode_base64url(self, encoded):
-        return urlsafe_b64decode(encoded + "=" * (4 - len(encoded) % 4))
+        dynamic_secret = self.get_signing_key(username)
+        return self.codec.encode(payload, dynamic_secret)
+
+    # check the signature of a decoded token against the key of its user
+    def verify_signature(self, signing_input, signature, dynamic_secret=None, username=None):
+        if dynamic_secret is None:
+            dynamic_secret = self.get_signing_key(username)
+        return self.codec.verify(signing_input, signature, dynamic_secret)
     
     # generate the current timestamp and calculate expired timesatmp 
     # reference: https://kb.narrative.io/what-is-unix-time#:~:text=Unix%20time%20is%20a%20way,and%20use%20across%20different%20systems.
@@ -0,0 +1,75 @@
+from base64 import b64encode, b64decode
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+
+# the hash functions live at module level so that they can be sent to the worker processes
+def hash_password(password, iterations, salt=None):
+    if salt is None:
+        salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "{}${}${}${}".format(HASH_ALGORITHM, iterations, b64encode(salt).decode(), b64encode(digest).decode())
+
+def check_password(password, stored):
+    _, iterations, salt, _ = stored.split("$")
+    expected = hash_password(password, int(iterations), b64decode(salt))
+    return hmac.compare_digest(expected.encode(), stored.encode())
+
+class PasswordBusyError(Exception):
+    pass
+
+class PasswordHandler(object):
+    def __init__(self):
+        self.file = open('../Config.json','r')
+        self.config = json.load(self.file)
+        self.file.close()
+        self.iterations = self.config["password-hash-iterations"]
+        self.workers = self.config["password-hash-workers"]
+        self.wait_timeout = self.config["password-hash-wait"]
+        # bounds the password operations queued on the pool, further requests wait at most
+        # password-hash-wait seconds and are then rejected instead of piling up
+        self.slots = threading.BoundedSemaphore(self.config["password-hash-queue"])
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    # the pool is created on first use so that it is started in the serving process
+    def get_pool(self):
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self.pool
+
+    def run(self, function, *args):
+        if self.workers == 0:
+            return function(*args)
+        if not self.slots.acquire(timeout=self.wait_timeout):
+            raise PasswordBusyError("too many password operations in progress")
+        try:
+            return self.get_pool().submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(hash_password, password, self.iterations)
+
+    # stored values without the algorithm prefix are legacy plaintext passwords
+    def is_hashed(self, stored):
+        return stored.startswith(HASH_ALGORITHM + "$")
+
+    def verify(self, password, stored):
+        if not self.is_hashed(stored):
+            return hmac.compare_digest(password.encode(), stored.encode())
+        return self.run(check_password, password, stored)
+
+    # plaintext rows and rows hashed with a different cost are rehashed after a successful login
+    def needs_rehash(self, stored):
+        if not self.is_hashed(stored):
+            return True
+        return int(stored.split("$")[1]) != self.iterations
+
+passwordHandler = PasswordHandler()
@@ -0,0 +1,91 @@
+# Throughput and latency of the service at increasing numbers of concurrent requests, to
+# compare the threaded and async serving modes. Start the service once with each
+# EXP_SERVER_MODE, e.g. `EXP_SERVER_MODE=async docker compose up -d experiment`, and point
+# a target at each. The requests are sent from gevent greenlets, so the client itself holds
+# thousands of connections:
+#   python benchmarks/load_test.py --target threaded=http://localhost:5050 \
+#       --target async=http://localhost:5051 --token <bearer token>
+# Without a token, GET /exp/ready is requested, it needs no authentication.
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import time  # noqa: E402
+import gevent  # noqa: E402
+import requests  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+
+CONCURRENCY = [1, 10, 100, 500, 1000, 2000]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def load(url, headers, concurrency, duration, timeout):
+    """Keep concurrency requests in flight for duration seconds, returns latencies and errors."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                response = session.get(url, headers=headers, timeout=timeout)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies.append(time.monotonic() - started)
+            else:
+                errors.append(time.monotonic() - started)
+
+    gevent.joinall([gevent.spawn(client) for _ in range(concurrency)])
+    session.close()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--target",
+        action="append",
+        required=True,
+        metavar="NAME=URL",
+        help="base URL of a running service, once per serving mode",
+    )
+    parser.add_argument("--token", help="bearer token, GET /exp/projects is requested with it")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds per request")
+    args = parser.parse_args()
+
+    path = "/exp/projects?summary=true" if args.token else "/exp/ready"
+    headers = {"Authorization": args.token} if args.token else {}
+    print(f"GET {path}")
+    print(f"{'mode':<10} {'in flight':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for target in args.target:
+        name, _, base = target.partition("=")
+        for concurrency in args.concurrency:
+            latencies, errors = load(
+                base.rstrip("/") + path, headers, concurrency, args.duration, args.timeout
+            )
+            if len(latencies) == 0:
+                print(f"{name:<10} {concurrency:>9} {'':>8} {'':>8} {'':>8} {len(errors):>7}")
+                continue
+            print(
+                f"{name:<10} {concurrency:>9} {len(latencies) / args.duration:>8.0f} "
+                f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} {len(errors):>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
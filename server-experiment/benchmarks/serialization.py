@@ -0,0 +1,105 @@
+# Time and peak memory of serializing experiment documents with 1 to 10 MB graphs, the
+# json.dumps(default=str) / json.loads round trip the handlers used against the single
+# pass of serializer.serialize_documents. Needs no database:
+#   python benchmarks/serialization.py
+import argparse
+import copy
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+from bson import ObjectId
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+from serializer import serialize_documents  # noqa: E402
+
+
+def variant(i):
+    return {
+        "id_task": f"task-{i}",
+        "name": f"task {i}",
+        "is_composite": False,
+        "parameters": [
+            {"id": f"p{p}", "name": f"parameter {p}", "type": "integer", "values": list(range(8))}
+            for p in range(4)
+        ],
+    }
+
+
+def experiment(size_mb):
+    # nodes of a few variants each, until the JSON of the graph reaches size_mb
+    nodes = []
+    edges = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        i = len(nodes)
+        node = {
+            "id": f"node-{i}",
+            "type": "task",
+            "position": {"x": i * 10.5, "y": i * 3.25},
+            "data": {"variants": [variant(i * 4 + v) for v in range(4)]},
+        }
+        nodes.append(node)
+        if i > 0:
+            edges.append({"id": f"edge-{i}", "source": f"node-{i - 1}", "target": f"node-{i}"})
+        size += len(json.dumps(node)) + 80
+    return {
+        "_id": ObjectId(),
+        "id_experiment": f"benchmark-{size_mb}",
+        "project_id": "benchmark",
+        "name": f"{size_mb} MB",
+        "create_at": datetime.datetime.utcnow(),
+        "update_at": 1700000000,
+        "graphical_model": {"nodes": nodes, "edges": edges},
+        "revision": 0,
+    }
+
+
+def round_trip(documents):
+    return json.loads(json.dumps(list(documents), default=str))
+
+
+def measure(function, document, repeat):
+    # tracemalloc slows allocations down, the peak is taken from a separate run
+    seconds = []
+    for _ in range(repeat):
+        # serialize_documents converts in place, every run gets its own copy
+        documents = [copy.deepcopy(document)]
+        started = time.perf_counter()
+        function(documents)
+        seconds.append(time.perf_counter() - started)
+    seconds.sort()
+
+    documents = [copy.deepcopy(document)]
+    tracemalloc.start()
+    result = function(documents)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return seconds[len(seconds) // 2], peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 5, 10], help="MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("   graph   round trip   one pass  speedup  peak round trip  peak one pass")
+    for size_mb in args.sizes:
+        document = experiment(size_mb)
+        expected = round_trip([copy.deepcopy(document)])
+        assert serialize_documents([copy.deepcopy(document)]) == expected
+        rt_time, rt_peak = measure(round_trip, document, args.repeat)
+        op_time, op_peak = measure(serialize_documents, document, args.repeat)
+        print(
+            f"{size_mb:>6} MB {rt_time * 1000:>9.1f} ms {op_time * 1000:>7.1f} ms "
+            f"{rt_time / op_time:>7.1f}x {rt_peak / 2**20:>13.1f} MB {op_peak / 2**20:>11.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
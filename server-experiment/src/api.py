@@ -1,11 +1,19 @@
-from flask import Flask, request, g
+from flask import Flask, Response, request, g
+from pymongo.errors import PyMongoError
 from flask_cors import CORS, cross_origin
+from etag import compute_etag, etag_header, not_modified
+from graphPatch import PatchError
+from pagination import next_cursor, parse_page_args
 from userAuthHandler import userAuthHandler
 from projectHandler import projectHandler
-from experimentHandler import experimentHandler
+from experimentHandler import MAX_BULK_OPERATIONS, experimentHandler
 from categoryHandler import categoryHandler
 from taskHandler import taskHandler
 from convertorHandler import convertorHandler
+from dbClient import mongo_client
+from reaper import reaper
+from startup import startup
+from uniqueName import missing_indexes
 
 app = Flask(__name__)
 cors = CORS(app)  # cors is added in advance to allow cors requests
@@ -14,8 +22,23 @@ app.config["CORS_HEADERS"] = "Content-Type"
 ERROR_FORBIDDEN = "Error: Forbidden"
 ERROR_DUPLICATE = "Error: Duplicate name"
 ERROR_NOT_FOUND = "Error: Not found"
+ERROR_BAD_REQUEST = "Error: Bad request"
+ERROR_CONFLICT = "Error: Revision conflict"
+ERROR_NOT_READY = "Error: Not ready"
 
-ENDPOINT_WITHOUT_AUTH = []
+ENDPOINT_WITHOUT_AUTH = ["ready"]
+
+
+def summary_requested():
+    # list routes return only ids, names and timestamps with ?fields=summary
+    return request.args.get("fields") == "summary"
+
+
+# handlers are built lazily, the first request of a process starts their warm-up
+# when the server did not start it already
+@app.before_request
+def start_process():
+    startup.start()
 
 
 # there's a bug in flask_cors that headers is None when using before_request for OPTIONS request
@@ -28,6 +51,8 @@ def verify_user():
     if token is None:
         return {"error": ERROR_FORBIDDEN, "message": "token is not provided"}, 403
     auth_res = userAuthHandler.verify_user(token)
+    if auth_res.get("unavailable"):
+        return {"error": ERROR_NOT_READY, "message": auth_res["error_type"]}, 503
     if not auth_res["valid"] or auth_res["username"] is None:
         return {"error": ERROR_FORBIDDEN, "message": auth_res["error_type"]}, 403
     g.username = auth_res["username"]
@@ -48,28 +73,67 @@ def index():
     return "experiment service connected"
 
 
+@app.route("/exp/ready", methods=["GET"])
+@cross_origin()
+def ready():
+    if not startup.ready:
+        return {"error": ERROR_NOT_READY, "message": startup.error or "starting"}, 503
+    try:
+        mongo_client.admin.command("ping")
+    except PyMongoError as e:
+        return {"error": ERROR_NOT_READY, "message": str(e)}, 503
+    return {
+        "message": "ready",
+        "data": {
+            "pid": startup.pid,
+            "startup_time": startup.startup_time,
+            # names are checked with a racy query until these exist
+            "missing_unique_indexes": missing_indexes(),
+        },
+    }, 200
+
+
 # PROJECTS
 @app.route("/exp/projects", methods=["GET"])
 @cross_origin()
 def get_projects():
-    projects = projectHandler.get_projects(g.username)
-    return {
-        "message": "projects retrieved",
-        "data": {"projects": projects},
-    }, 200
+    try:
+        limit, after = parse_page_args(request.args)
+    except ValueError:
+        return {"error": ERROR_BAD_REQUEST, "message": "invalid limit or cursor"}, 400
+    etag = compute_etag(
+        "projects",
+        request.query_string,
+        projectHandler.get_projects_versions(g.username),
+    )
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
+    projects = projectHandler.get_projects(
+        g.username, summary_requested(), limit, after
+    )
+    return (
+        {
+            "message": "projects retrieved",
+            "data": {
+                "projects": projects,
+                "next_cursor": next_cursor(projects, limit, "id_project"),
+            },
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 @app.route("/exp/projects/create", methods=["OPTIONS", "POST"])
 @cross_origin()
 def create_project():
     proj_name = request.json["name"]
-    if projectHandler.detect_duplicate(g.username, proj_name):
+    res = projectHandler.create_project(g.username, proj_name)
+    if res is None:
         return {
             "error": ERROR_DUPLICATE,
             "message": "Project name already exists",
         }, 409
-
-    res = projectHandler.create_project(g.username, proj_name)
     return {"message": "Project created.", "data": {"id_project": res}}, 201
 
 
@@ -77,15 +141,12 @@ def create_project():
 @cross_origin()
 def update_project_info(proj_id):
     proj_name = request.json["name"]
-    get_proj = projectHandler.get_project(proj_id)
-    if get_proj["name"] != proj_name:
-        if projectHandler.detect_duplicate(g.username, proj_name):
-            return {
-                "error": ERROR_DUPLICATE,
-                "message": "Project name already exists",
-            }, 409
     description = request.json["description"]  # can be empty
-    projectHandler.update_project_info(proj_id, proj_name, description)
+    if not projectHandler.update_project_info(proj_id, proj_name, description):
+        return {
+            "error": ERROR_DUPLICATE,
+            "message": "Project name already exists",
+        }, 409
     return {"message": "project info updated"}, 200
 
 
@@ -94,30 +155,58 @@ def update_project_info(proj_id):
 def delete_project(proj_id):
     if not projectHandler.project_exists(proj_id):
         return {"message": "project does not exist"}, 404
-    projectHandler.delete_project(proj_id)
-    experimentHandler.delete_experiments(proj_id)
-    return {"message": "project deleted"}, 204
+    # the experiments are deleted in the background
+    deletion = reaper.schedule("project", proj_id)
+    return {"message": "project deleted", "data": {"deletion": deletion}}, 202
+
+
+@app.route("/exp/projects/<proj_id>/deletion", methods=["GET"])
+@cross_origin()
+def get_project_deletion(proj_id):
+    deletion = reaper.get_job("project", proj_id)
+    if deletion is None:
+        return {"error": ERROR_NOT_FOUND, "message": "project was not deleted"}, 404
+    return {"message": "deletion retrieved", "data": {"deletion": deletion}}, 200
 
 
 # EXPERIMENTS
 @app.route("/exp/projects/<proj_id>/experiments", methods=["GET"])
 @cross_origin()
 def get_experiments(proj_id):
-    experiments = experimentHandler.get_experiments(proj_id)
+    try:
+        limit, after = parse_page_args(request.args)
+    except ValueError:
+        return {"error": ERROR_BAD_REQUEST, "message": "invalid limit or cursor"}, 400
+    experiments = experimentHandler.get_experiments(
+        proj_id, summary_requested(), limit, after
+    )
     return {
         "message": "experiments retrieved",
-        "data": {"experiments": experiments},
+        "data": {
+            "experiments": experiments,
+            "next_cursor": next_cursor(experiments, limit, "id_experiment"),
+        },
     }, 200
 
 
 @app.route("/exp/projects/experiments/<exp_id>", methods=["GET"])
 @cross_origin()
 def get_experiment(exp_id):
+    revision = experimentHandler.get_experiment_revision(exp_id)
+    if revision is None:
+        return {"error": ERROR_NOT_FOUND, "message": "experiment not found"}, 404
+    etag = compute_etag("experiment", exp_id, revision)
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
     experiment = experimentHandler.get_experiment(exp_id)
-    return {
-        "message": "experiment retrieved",
-        "data": {"experiment": experiment},
-    }, 200
+    return (
+        {
+            "message": "experiment retrieved",
+            "data": {"experiment": experiment},
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 @app.route("/exp/projects/<proj_id>/experiments/create", methods=["OPTIONS", "POST"])
@@ -125,17 +214,37 @@ def get_experiment(exp_id):
 def create_experiment(proj_id):
     exp_name = request.json["exp_name"]
     graphical_model = request.json["graphical_model"]
-    if experimentHandler.detect_duplicate(proj_id, exp_name):
+    res = experimentHandler.create_experiment(
+        g.username, proj_id, exp_name, graphical_model
+    )
+    if res is None:
         return {
             "error": ERROR_DUPLICATE,
             "message": "Experiment name already exists",
         }, 409
-    res = experimentHandler.create_experiment(
-        g.username, proj_id, exp_name, graphical_model
-    )
     return {"message": "Experiment created", "data": {"id_experiment": res}}, 201
 
 
+@app.route("/exp/projects/<proj_id>/experiments/bulk", methods=["OPTIONS", "POST"])
+@cross_origin()
+def bulk_experiments(proj_id):
+    # the operations move, rename and delete experiments, the project must be the user's
+    if proj_id not in projectHandler.get_owned_project_ids(g.username, [proj_id]):
+        return {"error": ERROR_NOT_FOUND, "message": "project does not exist"}, 404
+    if not isinstance(request.json, dict):
+        return {"error": ERROR_BAD_REQUEST, "message": "body must be a JSON object"}, 400
+    operations = request.json.get("operations")
+    if not isinstance(operations, list) or len(operations) == 0:
+        return {"error": ERROR_BAD_REQUEST, "message": "operations must be a non-empty list"}, 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return {
+            "error": ERROR_BAD_REQUEST,
+            "message": f"at most {MAX_BULK_OPERATIONS} operations per request",
+        }, 400
+    results = experimentHandler.bulk_experiments(g.username, proj_id, operations)
+    return {"message": "bulk operations applied", "data": {"results": results}}, 200
+
+
 @app.route(
     "/exp/projects/<proj_id>/experiments/<exp_id>/delete",
     methods=["OPTIONS", "DELETE"],
@@ -155,12 +264,11 @@ def delete_experiment(proj_id, exp_id):
 @cross_origin()
 def update_experiment_name(proj_id, exp_id):
     exp_name = request.json["exp_name"]
-    if experimentHandler.detect_duplicate(proj_id, exp_name):
+    if not experimentHandler.update_experiment_name(exp_id, proj_id, exp_name):
         return {
             "error": ERROR_DUPLICATE,
             "message": "Experiment name already exists",
         }, 409
-    experimentHandler.update_experiment_name(exp_id, proj_id, exp_name)
     return {"message": "experiment name updated"}, 200
 
 
@@ -177,28 +285,72 @@ def update_experiment_graphical_model(proj_id, exp_id):
     return {"message": "experiment graphical model updated"}, 200
 
 
+def read_patch_request():
+    # body of a graphical model PATCH: {"revision": <int>, "operations": [...]}
+    if not isinstance(request.json, dict):
+        raise PatchError("body must be a JSON object")
+    revision = request.json.get("revision")
+    if isinstance(revision, bool) or not isinstance(revision, int) or revision < 0:
+        raise PatchError("revision must be a non-negative integer")
+    return revision, request.json.get("operations")
+
+
+@app.route(
+    "/exp/projects/<proj_id>/experiments/<exp_id>/update/graphical_model",
+    methods=["PATCH"],
+)
+@cross_origin()
+def patch_experiment_graphical_model(proj_id, exp_id):
+    if not experimentHandler.experiment_exists(exp_id):
+        return {"error": ERROR_NOT_FOUND, "message": "experiment not found"}, 404
+    try:
+        revision, operations = read_patch_request()
+        new_revision = experimentHandler.patch_experiment_graphical_model(
+            exp_id, proj_id, revision, operations
+        )
+    except PatchError as e:
+        return {"error": ERROR_BAD_REQUEST, "message": str(e)}, 400
+    if new_revision is None:
+        return {
+            "error": ERROR_CONFLICT,
+            "message": "experiment was modified, reload it and retry",
+        }, 409
+    return {
+        "message": "experiment graphical model patched",
+        "data": {"revision": new_revision},
+    }, 200
+
+
 # CATEGORIES
 @app.route("/task/categories", methods=["GET"])
 @cross_origin()
 def get_categories():
+    etag = compute_etag(
+        "categories", categoryHandler.get_categories_versions(g.username)
+    )
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
     categories = categoryHandler.get_categories(g.username)
-    return {
-        "message": "categories retrieved",
-        "data": {"categories": categories},
-    }, 200
+    return (
+        {
+            "message": "categories retrieved",
+            "data": {"categories": categories},
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 @app.route("/task/categories/create", methods=["OPTIONS", "POST"])
 @cross_origin()
 def create_category():
     category_name = request.json["name"]
-    if categoryHandler.detect_duplicate(g.username, category_name):
+    res = categoryHandler.create_category(g.username, category_name)
+    if res is None:
         return {
             "error": ERROR_DUPLICATE,
             "message": "Category name already exists",
         }, 409
-
-    res = categoryHandler.create_category(g.username, category_name)
     return {"message": "Category created.", "data": {"id_category": res}}, 201
 
 
@@ -206,14 +358,11 @@ def create_category():
 @cross_origin()
 def update_category_name(category_id):
     category_name = request.json["name"]
-    get_category = categoryHandler.get_category(category_id)
-    if get_category["name"] != category_name:
-        if categoryHandler.detect_duplicate(g.username, category_name):
-            return {
-                "error": ERROR_DUPLICATE,
-                "message": "Category name already exists",
-            }, 409
-    categoryHandler.update_category_name(category_id, category_name)
+    if not categoryHandler.update_category_name(category_id, category_name):
+        return {
+            "error": ERROR_DUPLICATE,
+            "message": "Category name already exists",
+        }, 409
     return {"message": "category name updated"}, 200
 
 
@@ -223,30 +372,83 @@ def update_category_name(category_id):
 def delete_category(category_id):
     if not categoryHandler.category_exists(category_id):
         return {"error": ERROR_NOT_FOUND, "message": "category does not exist"}, 404
-    categoryHandler.delete_category(category_id)
-    taskHandler.delete_tasks(category_id)
-    return {"message": "category deleted"}, 204
+    # the tasks are deleted in the background
+    deletion = reaper.schedule("category", category_id)
+    return {"message": "category deleted", "data": {"deletion": deletion}}, 202
+
+
+@app.route("/task/categories/<category_id>/deletion", methods=["GET"])
+@cross_origin()
+def get_category_deletion(category_id):
+    deletion = reaper.get_job("category", category_id)
+    if deletion is None:
+        return {"error": ERROR_NOT_FOUND, "message": "category was not deleted"}, 404
+    return {"message": "deletion retrieved", "data": {"deletion": deletion}}, 200
+
+
+# CATALOG
+@app.route("/task/catalog", methods=["GET"])
+@cross_origin()
+def get_catalog():
+    etag = compute_etag(
+        "catalog",
+        categoryHandler.get_categories_versions(g.username),
+        taskHandler.get_user_tasks_versions(g.username),
+    )
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
+    categories = categoryHandler.get_categories(g.username)
+    catalog = taskHandler.get_catalog(categories, g.username)
+    return (
+        {
+            "message": "catalog retrieved",
+            "data": {"categories": catalog},
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 # TASKS
 @app.route("/task/categories/<category_id>/tasks", methods=["GET"])
 @cross_origin()
 def get_tasks(category_id):
-    tasks = taskHandler.get_tasks(category_id, g.username)
-    return {
-        "message": "tasks retrieved",
-        "data": {"tasks": tasks},
-    }, 200
+    etag = compute_etag(
+        "tasks",
+        request.query_string,
+        taskHandler.get_tasks_versions(category_id, g.username),
+    )
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
+    tasks = taskHandler.get_tasks(category_id, g.username, summary_requested())
+    return (
+        {
+            "message": "tasks retrieved",
+            "data": {"tasks": tasks},
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 @app.route("/task/categories/tasks/<task_id>", methods=["GET"])
 @cross_origin()
 def get_task(task_id):
+    version = taskHandler.get_task_version(task_id)
+    if version is None:
+        return {"error": ERROR_NOT_FOUND, "message": "this task does not exist"}, 404
+    etag = compute_etag("task", task_id, version)
+    if not_modified(etag):
+        return "", 304, etag_header(etag)
     task = taskHandler.get_task(task_id)
-    return {
-        "message": "task retrieved",
-        "data": {"task": task},
-    }, 200
+    return (
+        {
+            "message": "task retrieved",
+            "data": {"task": task},
+        },
+        200,
+        etag_header(etag),
+    )
 
 
 @app.route("/task/categories/<category_id>/tasks/create", methods=["OPTIONS", "POST"])
@@ -255,14 +457,14 @@ def create_task(category_id):
     task_name = request.json["name"]
     task_provider = request.json["provider"]
     graphical_model = request.json["graphical_model"]
-    if taskHandler.detect_duplicate(category_id, task_name):
+    res = taskHandler.create_task(
+        g.username, category_id, task_name, task_provider, graphical_model
+    )
+    if res is None:
         return {
             "error": ERROR_DUPLICATE,
             "message": "Task name already exists",
         }, 409
-    res = taskHandler.create_task(
-        g.username, category_id, task_name, task_provider, graphical_model
-    )
     return {"message": "Task created", "data": {"id_task": res}}, 201
 
 
@@ -286,12 +488,11 @@ def delete_task(task_id):
 def update_task_info(category_id, task_id):
     task_name = request.json["name"]
     task_description = request.json["description"]
-    if taskHandler.detect_duplicate(category_id, task_name):
+    if not taskHandler.update_task_info(task_id, task_name, task_description):
         return {
             "error": ERROR_DUPLICATE,
             "message": "Task name already exists",
         }, 409
-    taskHandler.update_task_info(task_id, task_name, task_description)
     return {"message": "task information updated"}, 200
 
 
@@ -306,6 +507,32 @@ def update_task_graphical_model(task_id):
     return {"message": "task graphical model updated"}, 200
 
 
+@app.route(
+    "/task/categories/tasks/<task_id>/update/graphical_model",
+    methods=["PATCH"],
+)
+@cross_origin()
+def patch_task_graphical_model(task_id):
+    if not taskHandler.task_exists(task_id):
+        return {"error": ERROR_NOT_FOUND, "message": "this task does not exist"}, 404
+    try:
+        revision, operations = read_patch_request()
+        new_revision = taskHandler.patch_task_graphical_model(
+            task_id, revision, operations
+        )
+    except PatchError as e:
+        return {"error": ERROR_BAD_REQUEST, "message": str(e)}, 400
+    if new_revision is None:
+        return {
+            "error": ERROR_CONFLICT,
+            "message": "task was modified, reload it and retry",
+        }, 409
+    return {
+        "message": "task graphical model patched",
+        "data": {"revision": new_revision},
+    }, 200
+
+
 # EXECUTION
 @app.route("/exp/execute/convert/<exp_id>", methods=["OPTIONS", "POST"])
 @cross_origin()
@@ -320,4 +547,32 @@ def convert_to_source_model(exp_id):
     return {"message": "source model converted", "data": convert_res["data"]}, 200
 
 
+@app.route("/exp/execute/deployed_workflows/<exp_id>/count", methods=["GET"])
+@cross_origin()
+def count_deployed_workflows(exp_id):
+    if not experimentHandler.experiment_exists(exp_id):
+        return {"error": ERROR_NOT_FOUND, "message": "experiment not found"}, 404
+    exp = experimentHandler.get_experiment(exp_id)
+    counts = convertorHandler.count_deployed_workflows(exp)
+    return {"message": "deployed workflows counted", "data": counts}, 200
+
+
+# NDJSON stream of the deployed workflows from index start, all remaining ones unless limit is given
+@app.route("/exp/execute/deployed_workflows/<exp_id>", methods=["GET"])
+@cross_origin()
+def stream_deployed_workflows(exp_id):
+    try:
+        start = int(request.args.get("start", 0))
+        limit = int(request.args.get("limit", 0))
+    except ValueError:
+        start = limit = -1
+    if start < 0 or limit < 0:
+        return {"error": ERROR_BAD_REQUEST, "message": "invalid start or limit"}, 400
+    if not experimentHandler.experiment_exists(exp_id):
+        return {"error": ERROR_NOT_FOUND, "message": "experiment not found"}, 404
+    exp = experimentHandler.get_experiment(exp_id)
+    lines = convertorHandler.stream_deployed_workflows(exp, start, limit)
+    return Response(lines, mimetype="application/x-ndjson")
+
+
 # 406: Not Acceptable
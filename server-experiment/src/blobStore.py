@@ -0,0 +1,128 @@
+# Content-addressed, compressed storage of the nested graphs of composite task variants. The
+# top-level graph of a document stays inline, so that PATCH can address its nodes and edges
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+import gridfs
+from pymongo.errors import DuplicateKeyError
+from dbClient import mongo_client
+from lazyInstance import LazyInstance
+
+GRAPH_FIELD = "graphical_model"
+REF_FIELD = "graphical_model_ref"
+# compressed graphs above this size are stored in GridFS, documents are limited to 16 MB
+GRIDFS_THRESHOLD = 8 * 1024 * 1024
+# bound of the decoded graphs kept in memory, per process
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+class BlobStore(object):
+    def __init__(self):
+        self.client = mongo_client
+        self.db = self.client.experiments
+        self.collection_blob = self.db.graph_blob
+        self.fs = gridfs.GridFSBucket(self.db, bucket_name="graph_blob_fs")
+        # blobs never change, decoded graphs can be cached without invalidation
+        self.cache = OrderedDict()
+        self.cache_bytes = CACHE_BYTES
+        self.cache_used = 0
+        self.cache_lock = threading.Lock()
+
+    def put(self, graph):
+        """Store the graph if it is not stored yet and return its digest."""
+        raw = json.dumps(graph, sort_keys=True, separators=(",", ":")).encode()
+        digest = hashlib.sha256(raw).hexdigest()
+        if self.collection_blob.count_documents({"_id": digest}, limit=1) > 0:
+            return digest
+
+        compressed = zlib.compress(raw)
+        blob = {"_id": digest, "size": len(raw), "compressed_size": len(compressed)}
+        file_id = None
+        if len(compressed) > GRIDFS_THRESHOLD:
+            file_id = self.fs.upload_from_stream(digest, compressed)
+            blob["gridfs"] = True
+            blob["gridfs_id"] = file_id
+        else:
+            blob["data"] = compressed
+        try:
+            self.collection_blob.insert_one(blob)
+        except DuplicateKeyError:
+            # stored concurrently, the content is the same. The blob of the other writer
+            # references its own file, ours would be an orphan
+            if file_id is not None:
+                self.fs.delete(file_id)
+        return digest
+
+    def has_nested_graphs(self, graph):
+        """Whether dehydrate_graph would store blobs for the graph."""
+        return any(isinstance(v.get(GRAPH_FIELD), dict) for v in composite_variants(graph))
+
+    def get(self, digest):
+        """Return a fresh copy of the graph with the given digest."""
+        with self.cache_lock:
+            raw = self.cache.get(digest)
+            if raw is not None:
+                self.cache.move_to_end(digest)
+        if raw is None:
+            raw = self.__load(digest)
+            with self.cache_lock:
+                if digest not in self.cache and len(raw) <= self.cache_bytes:
+                    self.cache[digest] = raw
+                    self.cache_used += len(raw)
+                while self.cache_used > self.cache_bytes:
+                    self.cache_used -= len(self.cache.popitem(last=False)[1])
+        # parsed on every read, callers may modify the returned graph
+        return json.loads(raw)
+
+    def __load(self, digest):
+        blob = self.collection_blob.find_one({"_id": digest})
+        if blob is None:
+            raise KeyError(f"graph {digest} not found")
+        if "gridfs_id" in blob:
+            compressed = self.fs.open_download_stream(blob["gridfs_id"]).read()
+        elif blob.get("gridfs"):
+            # stored before the file id was recorded
+            compressed = self.fs.open_download_stream_by_name(digest).read()
+        else:
+            compressed = blob["data"]
+        return zlib.decompress(compressed)
+
+    def dehydrate_graph(self, graph):
+        """Replace the nested graphs of composite variants by their digest, in place."""
+        for variant in composite_variants(graph):
+            nested = variant.get(GRAPH_FIELD)
+            if isinstance(nested, dict):
+                self.dehydrate_graph(nested)
+                variant[REF_FIELD] = self.put(nested)
+                del variant[GRAPH_FIELD]
+        return graph
+
+    def hydrate_document(self, document):
+        """Hydrate the graphical model of an experiment or task document, in place."""
+        if document is not None and isinstance(document.get(GRAPH_FIELD), dict):
+            self.hydrate_graph(document[GRAPH_FIELD])
+        return document
+
+    def hydrate_graph(self, graph):
+        """Replace the digests of composite variants by their graphs, in place."""
+        for variant in composite_variants(graph):
+            if REF_FIELD in variant:
+                nested = self.get(variant.pop(REF_FIELD))
+                variant[GRAPH_FIELD] = self.hydrate_graph(nested)
+        return graph
+
+
+def composite_variants(graph):
+    if not isinstance(graph, dict):
+        return
+    for node in graph.get("nodes", []):
+        if not isinstance(node, dict) or node.get("type") != "task":
+            continue
+        for variant in node.get("data", {}).get("variants", []):
+            if isinstance(variant, dict) and variant.get("is_composite"):
+                yield variant
+
+
+blobStore = LazyInstance(BlobStore)
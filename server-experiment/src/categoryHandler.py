@@ -1,8 +1,12 @@
 import calendar
-import json
 import time
 import pymongo
+from pymongo.errors import DuplicateKeyError
 from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from officialCatalog import officialCatalog
+from serializer import serialize_document, serialize_documents
+from uniqueName import UniqueName
 
 
 class CategoryHandler:
@@ -10,32 +14,58 @@ class CategoryHandler:
         self.client = mongo_client
         self.db = self.client.tasks
         self.collection_category = self.db.category
-        if self.collection_category.count_documents({}) == 0:
-            with open("../tasks/official_tasks.json") as f:
-                data = json.load(f)
-                for category in data["category"]:
-                    self.collection_category.insert_one(category)
-                f.close()
+        self.init_indexes()
 
+    def init_indexes(self):
+        self.collection_category.create_index("id_category", unique=True)
+        # get_categories and get_categories_versions
+        self.collection_category.create_index(
+            [
+                ("owner", pymongo.ASCENDING),
+                ("id_category", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        self.collection_category.create_index(
+            [
+                ("is_official", pymongo.ASCENDING),
+                ("id_category", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # category names are unique per owner
+        self.unique_name = UniqueName(self.collection_category, "owner", "id_category")
+
+    # served from the in-memory catalog, the documents are shared and must not be modified
     def get_official_categories(self):
-        query = {"is_official": True}
-        documents = self.collection_category.find(query)
-        return json.loads(json.dumps(list(documents), default=str))
+        return list(officialCatalog.get_categories())
 
     def get_categories(self, username):
         query = {"owner": username}
         documents = self.collection_category.find(query)
         # combine official categories with user's categories
         official_categories = self.get_official_categories()
-        user_categories = json.loads(json.dumps(list(documents), default=str))
+        user_categories = serialize_documents(documents)
 
         categories = official_categories + user_categories
         return categories
 
+    # (id, revision) of the official and the user's categories, the user's are answered from the index
+    def get_categories_versions(self, username):
+        projection = {"_id": 0, "id_category": 1, "revision": 1}
+        versions = [["official", officialCatalog.get_version()]]
+        versions += [
+            [doc["id_category"], doc.get("revision", 0)]
+            for doc in officialCatalog.get_categories()
+        ]
+        documents = self.collection_category.find({"owner": username}, projection)
+        versions += [[doc["id_category"], doc.get("revision", 0)] for doc in documents]
+        return versions
+
     def get_category(self, category_id):
         query = {"id_category": category_id}
         documents = self.collection_category.find(query)
-        return json.loads(json.dumps(documents[0], default=str))
+        return serialize_document(documents[0])
 
     def category_exists(self, category_id):
         query = {"id_category": category_id}
@@ -53,27 +83,32 @@ class CategoryHandler:
             "name": category_name,
             "is_official": False,
             "owner": username,
+            "revision": 0,
         }
-        self.collection_category.insert_one(query)
+        # returns None if the owner already has a category with this name
+        if self.unique_name.is_taken(username, category_name):
+            return None
+        try:
+            self.collection_category.insert_one(query)
+        except DuplicateKeyError:
+            return None
         return category_id
 
-    # FIXME: bad implementation
-    def detect_duplicate(self, username, category_name):
-        query = {"owner": username}
-        documents = self.collection_category.find(query)
-        for doc in documents:
-            if doc["name"] == category_name:
-                return True
-        return False
-
     def update_category_name(self, category_id, category_name):
         query = {"id_category": category_id}
         new_values = {
             "$set": {
                 "name": category_name,
-            }
+            },
+            "$inc": {"revision": 1},
         }
-        self.collection_category.update_one(query, new_values)
+        # returns False if the owner already has another category with this name
+        if self.unique_name.is_taken_by_other(category_id, category_name):
+            return False
+        try:
+            self.collection_category.update_one(query, new_values)
+        except DuplicateKeyError:
+            return False
         return True
 
     def delete_category(self, category_id):
@@ -82,4 +117,4 @@ class CategoryHandler:
         return True
 
 
-categoryHandler = CategoryHandler()
+categoryHandler = LazyInstance(CategoryHandler)
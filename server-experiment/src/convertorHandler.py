@@ -1,21 +1,28 @@
 import json
-import itertools
+import math
 import requests
 from nanoid import generate
+from lazyInstance import LazyInstance
 
 
-class ConvertorHandler:
-    """ConvertorHandler class is responsible for converting the graphical model to the EMF model."""
+class ConversionContext(object):
+    """State of a single conversion."""
 
     def __init__(self):
-        self.url = "http://emf-cloud-service:8081/api/v2"
-        self.meta_model_loc = self.__init_meta_model_location()
-        self.root_type = "Specification"
         self.workflow = []
         self.workflow_tasks_dict = {}
         self.task_variant_map = {}
         self.experiment_space = []
         self.primitive_types = []
+
+
+class ConvertorHandler:
+    """ConvertorHandler class is responsible for converting the graphical model to the EMF model."""
+
+    def __init__(self):
+        self.url = "http://emf-cloud-service:8081/api/v2"
+        self.meta_model_loc = self.__init_meta_model_location()
+        self.root_type = "Specification"
         self.primitive_types_map = {
             "integer": "NUMBER",
             "real": "NUMBER",
@@ -33,33 +40,21 @@ class ConvertorHandler:
         location = response.json()["data"]["$type"].split("#//")[0]
         return f"{location}#//"
 
-    def __clear_maps(self):
-        """Clear the maps for the next conversion."""
-        self.workflow = []
-        self.workflow_tasks_dict = {}
-        self.task_variant_map = {}
-        self.experiment_space = []
-        self.primitive_types = []
-
     def convert(self, exp):
         """Convert the graphical model to the EMF model."""
 
-        self.__clear_maps()
-        self.workflow = [{"$id": "workflow-0", "name": "main", "node": [], "link": []}]
-        self.workflow[0] = self.__convert_workflow(
-            exp["graphical_model"], self.workflow[0]
-        )
-        deployed_workflow_combinations = self.__compute_deployed_workflow_combinations()
-        deployed_workflows = self.__generate_all_deployed_workflows(
-            deployed_workflow_combinations
-        )
+        context = self.__prepare(exp["graphical_model"])
+        deployed_workflows = []
+        for _, deployed_workflow, experiment_space in self.__iter_deployed_workflows(context):
+            deployed_workflows.append(deployed_workflow)
+            context.experiment_space.append(experiment_space)
 
         emf_model = {
             "$type": self.__emf_object_type(self.root_type),
-            "parametertypes": self.primitive_types,
-            "workflow": self.workflow,
+            "parametertypes": context.primitive_types,
+            "workflow": context.workflow,
             "deployedworkflow": deployed_workflows,
-            "experimentspace": self.experiment_space,
+            "experimentspace": context.experiment_space,
         }
 
         data = json.dumps({"data": emf_model})
@@ -89,7 +84,56 @@ class ConvertorHandler:
 
         return {"success": True, "data": {"json": emf_model, "xmi": xmi_model}}
 
-    def __convert_workflow(self, graphical_model, workflow):
+    def count_deployed_workflows(self, exp):
+        """Count the deployed workflows of the experiment without generating them."""
+        context = self.__prepare(exp["graphical_model"])
+        counts = self.__count_deployed_workflows(context)
+        return {"count": sum(counts.values()), "workflows": counts}
+
+    def stream_deployed_workflows(self, exp, start=0, limit=0):
+        """Generator of the deployed workflows from index start as NDJSON lines, all if limit is 0.
+
+        The first line holds the total count and the parameter types referenced
+        by the following lines, each following line holds one deployed workflow
+        and its experiment space. Only one deployed workflow is in memory at a time.
+        The experiment is converted and counted before this returns, so that a
+        conversion error is raised before the response starts.
+        """
+        context = self.__prepare(exp["graphical_model"])
+        # the primitive types are registered up front, so that they can be sent first
+        for variant in context.task_variant_map.values():
+            for parameter in variant.get("parameters", []):
+                self.__generate_primitive_type(context, parameter.get("type"))
+        header = {
+            "count": sum(self.__count_deployed_workflows(context).values()),
+            "start": start,
+            "parametertypes": context.primitive_types,
+        }
+        return self.__stream_lines(context, header, start, limit)
+
+    def __stream_lines(self, context, header, start, limit):
+        yield json.dumps(header) + "\n"
+        for index, deployed_workflow, experiment_space in self.__iter_deployed_workflows(
+            context, start, limit
+        ):
+            line = {
+                "index": index,
+                "deployedworkflow": deployed_workflow,
+                "experimentspace": experiment_space,
+            }
+            yield json.dumps(line) + "\n"
+
+    def __prepare(self, graphical_model):
+        """Convert the workflows, the deployed workflows are generated on demand."""
+        # state of this conversion, conversions can run concurrently on the shared handler
+        context = ConversionContext()
+        context.workflow = [{"$id": "workflow-0", "name": "main", "node": [], "link": []}]
+        context.workflow[0] = self.__convert_workflow(
+            context, graphical_model, context.workflow[0]
+        )
+        return context
+
+    def __convert_workflow(self, context, graphical_model, workflow):
         """Convert the workflow structure"""
 
         nodes = graphical_model["nodes"]
@@ -111,7 +155,7 @@ class ConvertorHandler:
                     "name": "END",
                 }
             elif node_type == "task":
-                emf_node = self.__convert_task_node_to_emf(workflow["$id"], node)
+                emf_node = self.__convert_task_node_to_emf(context, workflow["$id"], node)
             elif node_type in ("opParallel", "opExclusive", "opInclusive", "opComplex"):
                 emf_node = self.__convert_operator_node_to_emf(node, nodes, links)
 
@@ -143,9 +187,9 @@ class ConvertorHandler:
 
         return workflow
 
-    def __convert_task_node_to_emf(self, workflow_id, node):
+    def __convert_task_node_to_emf(self, context, workflow_id, node):
         """Convert the task node structure"""
-        self.workflow_tasks_dict.setdefault(workflow_id, {})[node["id"]] = []
+        context.workflow_tasks_dict.setdefault(workflow_id, {})[node["id"]] = []
 
         emf_node = {
             "$type": f"{self.meta_model_loc}Task",
@@ -154,8 +198,8 @@ class ConvertorHandler:
         }
 
         for variant in node["data"]["variants"]:
-            self.workflow_tasks_dict[workflow_id][node["id"]].append(variant["id_task"])
-            self.task_variant_map[variant["id_task"]] = (
+            context.workflow_tasks_dict[workflow_id][node["id"]].append(variant["id_task"])
+            context.task_variant_map[variant["id_task"]] = (
                 variant  # both composite and non-composite tasks are added to the task map
             )
 
@@ -166,8 +210,8 @@ class ConvertorHandler:
                     "node": [],
                     "link": [],
                 }
-                self.workflow.append(
-                    self.__convert_workflow(variant["graphical_model"], subflow)
+                context.workflow.append(
+                    self.__convert_workflow(context, variant["graphical_model"], subflow)
                 )
 
         return emf_node
@@ -245,31 +289,59 @@ class ConvertorHandler:
             for case in condition["cases"]
         ]
 
-    def __compute_deployed_workflow_combinations(self):
-        """Compute all the possible combinations of the deployed workflows."""
-        # Cartesian product of the tasks of each workflow
+    def __count_deployed_workflows(self, context):
+        """Number of deployed workflows of each workflow, the size of the Cartesian product of its task variants."""
         return {
-            workflow_id: list(itertools.product(*tasks.values()))
-            for workflow_id, tasks in self.workflow_tasks_dict.items()
+            workflow_id: math.prod(len(variants) for variants in tasks.values())
+            for workflow_id, tasks in context.workflow_tasks_dict.items()
         }
 
-    def __generate_deployed_workflow(self, workflow_id, tasks_dict):
-        """Generate the deployed workflow."""
+    def __unrank_combination(self, context, workflow_id, index):
+        """Variant of each task in the index-th combination, in itertools.product order."""
+        tasks = context.workflow_tasks_dict[workflow_id]
+        variants = {}
+        # mixed-radix digits of index, the last task varies fastest
+        for task_id, task_variants in reversed(list(tasks.items())):
+            index, digit = divmod(index, len(task_variants))
+            variants[task_id] = task_variants[digit]
+        return {task_id: variants[task_id] for task_id in tasks}
+
+    def __iter_deployed_workflows(self, context, start=0, limit=0):
+        """Generate (index, deployed workflow, experiment space) from index start, all if limit is 0.
+
+        Indexes run over the workflows in order and over the combinations of
+        each workflow in itertools.product order.
+        """
+        end = None if limit == 0 else start + limit
+        offset = 0
+        for workflow_id, count in self.__count_deployed_workflows(context).items():
+            first = max(start - offset, 0)
+            last = count if end is None else min(end - offset, count)
+            for index in range(first, last):
+                tasks_dict = self.__unrank_combination(context, workflow_id, index)
+                deployed_workflow, experiment_space = self.__generate_deployed_workflow(
+                    context, workflow_id, tasks_dict
+                )
+                yield offset + index, deployed_workflow, experiment_space
+            offset += count
+
+    def __generate_deployed_workflow(self, context, workflow_id, tasks_dict):
+        """Generate the deployed workflow and its experiment space."""
 
         deployed_workflow_id = f"deployedworkflow-{generate(size=5)}"
 
         parameter_list = [
             parameter
             for variant_id in tasks_dict.values()
-            if variant_id in self.task_variant_map
-            for parameter in self.task_variant_map[variant_id].get("parameters", [])
+            if variant_id in context.task_variant_map
+            for parameter in context.task_variant_map[variant_id].get("parameters", [])
         ]
 
-        self.experiment_space.append(
-            self.__generate_experiment_space(deployed_workflow_id, parameter_list)
+        experiment_space = self.__generate_experiment_space(
+            context, deployed_workflow_id, parameter_list
         )
 
-        return {
+        deployed_workflow = {
             "$type": self.__emf_object_type("DeployedWorkflow"),
             "$id": deployed_workflow_id,
             "workflow": {
@@ -279,9 +351,9 @@ class ConvertorHandler:
             "configuredtask": [
                 {
                     "$id": f"configuredtask-{generate(size=5)}",
-                    "name": self.task_variant_map[variant_id].get("name"),
-                    "description": self.task_variant_map[variant_id].get("description"),
-                    "implementationRef": self.task_variant_map[variant_id].get(
+                    "name": context.task_variant_map[variant_id].get("name"),
+                    "description": context.task_variant_map[variant_id].get("description"),
+                    "implementationRef": context.task_variant_map[variant_id].get(
                         "implementationRef"
                     ),
                     "configuration": {
@@ -294,10 +366,10 @@ class ConvertorHandler:
                             "$id": deployed_workflow_id + parameter.get("id"),
                             "name": parameter.get("name"),
                             "type": self.__generate_primitive_type(
-                                parameter.get("type")
+                                context, parameter.get("type")
                             ),
                         }
-                        for parameter in self.task_variant_map[variant_id].get(
+                        for parameter in context.task_variant_map[variant_id].get(
                             "parameters", []
                         )
                     ],
@@ -305,29 +377,16 @@ class ConvertorHandler:
                 for task_id, variant_id in tasks_dict.items()
             ],
         }
+        return deployed_workflow, experiment_space
 
-    def __generate_all_deployed_workflows(self, deployed_workflow_combinations):
-        """Generate all deployed workflows based on combinations."""
-        deployed_workflows = []
-        for workflow_id, combinations in deployed_workflow_combinations.items():
-            for tasks in combinations:
-                # get tasks key in the workflow_tasks_dict
-                tasks_dict = dict(
-                    zip(self.workflow_tasks_dict[workflow_id].keys(), tasks)
-                )
-                deployed_workflows.append(
-                    self.__generate_deployed_workflow(workflow_id, tasks_dict)
-                )
-        return deployed_workflows
-
-    def __generate_experiment_space(self, deployed_workflow_id, parameters):
+    def __generate_experiment_space(self, context, deployed_workflow_id, parameters):
         """Generate the experiment space."""
 
         parameter_domain = [
             {
                 "$id": f"parameterdomain-{generate(size=10)}",
                 "name": parameter.get("name"),
-                "type": self.__generate_primitive_type(parameter.get("type")),
+                "type": self.__generate_primitive_type(context, parameter.get("type")),
                 "value": value,
                 "staticparameter": {
                     "$type": self.__emf_object_type("StaticParameter"),
@@ -347,12 +406,12 @@ class ConvertorHandler:
             "parameterdomain": parameter_domain,
         }
 
-    def __generate_primitive_type(self, type_name):
+    def __generate_primitive_type(self, context, type_name):
         """Generate the primitive type."""
         type_name = self.primitive_types_map.get(type_name, "STRING")
 
-        if not self.__type_exists(type_name):
-            self.primitive_types.append(
+        if not self.__type_exists(context, type_name):
+            context.primitive_types.append(
                 {
                     "$type": self.__emf_object_type("PrimitiveType"),
                     "$id": f"primitive-{generate(size=3)}",
@@ -360,7 +419,7 @@ class ConvertorHandler:
                     "name": type_name,
                 }
             )
-        for primitive in self.primitive_types:
+        for primitive in context.primitive_types:
             if primitive.get("type") == type_name:
                 return {
                     "$type": self.__emf_object_type("PrimitiveType"),
@@ -369,9 +428,9 @@ class ConvertorHandler:
 
         return None
 
-    def __type_exists(self, type_name):
+    def __type_exists(self, context, type_name):
         return any(
-            primitive.get("type") == type_name for primitive in self.primitive_types
+            primitive.get("type") == type_name for primitive in context.primitive_types
         )
 
     def __emf_object_type(self, type_name):
@@ -410,4 +469,4 @@ class ConvertorHandler:
         return self.__emf_object_type(type_map.get(node["type"], None))
 
 
-convertorHandler = ConvertorHandler()
+convertorHandler = LazyInstance(ConvertorHandler)
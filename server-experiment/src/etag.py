@@ -0,0 +1,28 @@
+"""Strong ETags for experiment service resources.
+
+Every write to a project, experiment, category or task increments its
+"revision". A resource's ETag is a digest of the ids and revisions it is
+built from, so it can be computed from a narrow projection served by an index,
+without loading the graphical model. Documents written before revisions
+existed count as revision 0.
+"""
+
+import hashlib
+import json
+
+from flask import request
+
+
+def compute_etag(*parts):
+    """Unquoted ETag value for the given ids and revisions."""
+    raw = json.dumps(parts, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def etag_header(etag):
+    return {"ETag": f'"{etag}"'}
+
+
+def not_modified(etag):
+    """True if If-None-Match of the request matches the ETag (weak comparison, RFC 7232)."""
+    return request.if_none_match.contains_weak(etag)
@@ -6,6 +6,7 @@ It is not the final implementation of the execution handler as the result of the
 import os
 import pandas as pd
 from dbClient import mongo_client
+from lazyInstance import LazyInstance
 
 
 class ExecutionHandler(object):
@@ -121,4 +122,4 @@ class ExecutionHandler(object):
         return False
 
 
-executionHandler = ExecutionHandler()
+executionHandler = LazyInstance(ExecutionHandler)
@@ -1,9 +1,31 @@
 import pymongo
-import json
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import time
 import calendar
+from blobStore import blobStore
 from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from pagination import after_query
+from graphPatch import apply_patch
+from serializer import serialize_document, serialize_documents
 from projectHandler import projectHandler
+from uniqueName import UniqueName
+
+
+# fields returned by the summary listing, the graphical model is only sent by get_experiment
+SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id_experiment": 1,
+    "project_id": 1,
+    "name": 1,
+    "create_at": 1,
+    "update_at": 1,
+}
+
+# operations accepted by a single bulk request
+MAX_BULK_OPERATIONS = 1000
+DUPLICATE_KEY = 11000
 
 
 class ExperimentHandler(object):
@@ -11,14 +33,41 @@ class ExperimentHandler(object):
         self.client = mongo_client
         self.db = self.client.experiments
         self.collection_experiment = self.db.experiment
+        self.init_indexes()
 
-    def get_experiments(self, proj_id):
+    def init_indexes(self):
+        self.collection_experiment.create_index("id_experiment", unique=True)
+        # get_experiment_revision
+        self.collection_experiment.create_index(
+            [("id_experiment", pymongo.ASCENDING), ("revision", pymongo.ASCENDING)]
+        )
+        # get_experiments: find by project_id, sorted and paginated by (update_at, id_experiment)
+        self.collection_experiment.create_index(
+            [
+                ("project_id", pymongo.ASCENDING),
+                ("update_at", pymongo.DESCENDING),
+                ("id_experiment", pymongo.DESCENDING),
+            ]
+        )
+        # experiment names are unique per project
+        self.unique_name = UniqueName(self.collection_experiment, "project_id", "id_experiment")
+
+    def get_experiments(self, proj_id, summary=False, limit=0, after=None):
         query = {"project_id": proj_id}
-        documents = self.collection_experiment.find(query).sort(
-            "update_at", pymongo.DESCENDING
+        if after is not None:
+            query.update(after_query(after, "id_experiment"))
+        projection = SUMMARY_PROJECTION if summary else None
+        documents = (
+            self.collection_experiment.find(query, projection)
+            .sort([("update_at", pymongo.DESCENDING), ("id_experiment", pymongo.DESCENDING)])
+            .limit(limit)
         )
-        # return documents in JSON format
-        return json.loads(json.dumps(list(documents), default=str))
+        # return documents in JSON compatible format
+        experiments = serialize_documents(documents)
+        if not summary:
+            for experiment in experiments:
+                blobStore.hydrate_document(experiment)
+        return experiments
 
     def experiment_exists(self, exp_id):
         query = {"id_experiment": exp_id}
@@ -31,9 +80,22 @@ class ExperimentHandler(object):
     def get_experiment(self, exp_id):
         query = {"id_experiment": exp_id}
         documents = self.collection_experiment.find(query)
-        return json.loads(json.dumps(documents[0], default=str))
+        return blobStore.hydrate_document(serialize_document(documents[0]))
+
+    # revision of the experiment without loading it, None if it does not exist
+    def get_experiment_revision(self, exp_id):
+        query = {"id_experiment": exp_id}
+        document = self.collection_experiment.find_one(query, {"_id": 0, "revision": 1})
+        if document is None:
+            return None
+        return document.get("revision", 0)
 
     def create_experiment(self, username, proj_id, exp_name, graphical_model):
+        # returns None if the project already has an experiment with this name, checked
+        # before the nested graphs are stored so that a rejected create writes nothing
+        nested = blobStore.has_nested_graphs(graphical_model)
+        if self.unique_name.is_taken(proj_id, exp_name, force=nested):
+            return None
         create_time = calendar.timegm(time.gmtime())  # get current time in seconds
         exp_id = username + "-" + exp_name.replace(" ", "") + "-" + str(create_time)
         query = {
@@ -42,9 +104,13 @@ class ExperimentHandler(object):
             "name": exp_name,
             "create_at": create_time,
             "update_at": create_time,
-            "graphical_model": graphical_model,
+            "graphical_model": blobStore.dehydrate_graph(graphical_model),
+            "revision": 0,
         }
-        self.collection_experiment.insert_one(query)
+        try:
+            self.collection_experiment.insert_one(query)
+        except DuplicateKeyError:
+            return None
 
         projectHandler.update_project_update_at(proj_id)
         return exp_id
@@ -59,20 +125,20 @@ class ExperimentHandler(object):
         query = {"project_id": proj_id}
         self.collection_experiment.delete_many(query)
 
-    # FIXME: bad implementation
-    def detect_duplicate(self, proj_id, exp_name):
-        query = {"project_id": proj_id, "name": exp_name}
-        documents = self.collection_experiment.find(query)
-        for doc in documents:
-            if doc["name"] == exp_name:
-                return True
-        return False
-
     def update_experiment_name(self, exp_id, proj_id, exp_name):
         update_time = calendar.timegm(time.gmtime())
         query = {"id_experiment": exp_id}
-        new_values = {"$set": {"name": exp_name, "update_at": update_time}}
-        self.collection_experiment.update_one(query, new_values)
+        new_values = {
+            "$set": {"name": exp_name, "update_at": update_time},
+            "$inc": {"revision": 1},
+        }
+        # returns False if the project already has another experiment with this name
+        if self.unique_name.is_taken(proj_id, exp_name, exp_id):
+            return False
+        try:
+            self.collection_experiment.update_one(query, new_values)
+        except DuplicateKeyError:
+            return False
 
         projectHandler.update_project_update_at(proj_id)
         return True
@@ -81,7 +147,11 @@ class ExperimentHandler(object):
         update_time = calendar.timegm(time.gmtime())
         query = {"id_experiment": exp_id}
         new_values = {
-            "$set": {"graphical_model": graphical_model, "update_at": update_time}
+            "$set": {
+                "graphical_model": blobStore.dehydrate_graph(graphical_model),
+                "update_at": update_time,
+            },
+            "$inc": {"revision": 1},
         }
         self.collection_experiment.update_one(query, new_values)
 
@@ -89,4 +159,161 @@ class ExperimentHandler(object):
         return True
 
 
-experimentHandler = ExperimentHandler()
+    # apply JSON Patch operations to the graphical model, returns the new revision
+    # or None if the experiment is not at the expected revision anymore
+    def patch_experiment_graphical_model(self, exp_id, proj_id, revision, operations):
+        update_time = calendar.timegm(time.gmtime())
+        query = {"id_experiment": exp_id}
+        new_revision = apply_patch(
+            self.collection_experiment, query, revision, operations, update_time
+        )
+        if new_revision is not None:
+            projectHandler.update_project_update_at(proj_id)
+        return new_revision
+
+    # apply create, update and delete operations on the experiments of a project with a single
+    # unordered bulk write, returns one result per operation in the order of the operations
+    def bulk_experiments(self, username, proj_id, operations):
+        update_time = calendar.timegm(time.gmtime())
+        # update and delete only apply to experiments of the project, missing ones are reported
+        # without being sent
+        ids = [op.get("id_experiment") for op in operations if isinstance(op, dict)]
+        existing = {
+            doc["id_experiment"]: doc["name"]
+            for doc in self.collection_experiment.find(
+                {"project_id": proj_id, "id_experiment": {"$in": ids}},
+                {"_id": 0, "id_experiment": 1, "name": 1},
+            )
+        }
+        # experiments are only moved to existing projects of the user
+        targets = set(
+            op["project_id"]
+            for op in operations
+            if isinstance(op, dict) and isinstance(op.get("project_id"), str)
+        )
+        targets.discard(proj_id)
+        if len(targets) > 0:
+            targets = projectHandler.get_owned_project_ids(username, targets)
+
+        results = []
+        requests = []
+        request_indexes = []  # index in results of each request
+        request_targets = []  # project of the experiment after each request
+        for index, op in enumerate(operations):
+            result = {"index": index}
+            results.append(result)
+            try:
+                request, exp_id, target = self.__bulk_request(
+                    username, proj_id, op, existing, update_time
+                )
+            except ValueError as e:
+                result.update({"status": 400, "message": str(e)})
+                continue
+            if request is None:
+                result.update({"status": 404, "message": "experiment not found"})
+                continue
+            if target != proj_id and target not in targets:
+                result.update({"status": 404, "message": "target project not found"})
+                continue
+            if self.__bulk_name_taken(op, existing, exp_id, target):
+                result.update({"status": 409, "message": "Experiment name already exists"})
+                continue
+            if "graphical_model" in op:
+                # stored once the operation passed its checks, in place: the request
+                # holds the same graph
+                blobStore.dehydrate_graph(op["graphical_model"])
+            result["id_experiment"] = exp_id
+            result["status"] = 201 if op["op"] == "create" else 200
+            requests.append(request)
+            request_indexes.append(index)
+            request_targets.append(target)
+
+        if len(requests) == 0:
+            return results
+        errors = []
+        try:
+            self.collection_experiment.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+        for error in errors:
+            index = request_indexes[error["index"]]
+            if error["code"] == DUPLICATE_KEY:
+                status, message = 409, "Experiment name already exists"
+            else:
+                status, message = 400, error["errmsg"]
+            if results[index]["status"] == 201:
+                del results[index]["id_experiment"]  # not created
+            results[index].update({"status": status, "message": message})
+
+        # one update of the project, and of the targets of moved experiments
+        failed = set(error["index"] for error in errors)
+        touched = set(
+            target for position, target in enumerate(request_targets) if position not in failed
+        )
+        if len(touched) > 0:
+            touched.add(proj_id)
+        for project_id in touched:
+            projectHandler.update_project_update_at(project_id)
+        return results
+
+    # the bulk write reports duplicates, the name is only checked when the unique name index
+    # is missing or before nested graphs are stored
+    def __bulk_name_taken(self, op, existing, exp_id, target):
+        nested = "graphical_model" in op and blobStore.has_nested_graphs(op["graphical_model"])
+        if op["op"] == "create":
+            return self.unique_name.is_taken(target, op["exp_name"], force=nested)
+        if op["op"] == "update" and ("exp_name" in op or "project_id" in op):
+            name = op.get("exp_name", existing[exp_id])
+            return self.unique_name.is_taken(target, name, exp_id, force=nested)
+        return False
+
+    def __bulk_request(self, username, proj_id, op, existing, update_time):
+        # returns (request, experiment id, project of the experiment afterwards),
+        # request is None when the experiment does not exist
+        if not isinstance(op, dict):
+            raise ValueError("operations must be objects")
+        kind = op.get("op")
+        if kind == "create":
+            exp_name = op.get("exp_name")
+            if not isinstance(exp_name, str) or "graphical_model" not in op:
+                raise ValueError("create requires exp_name and graphical_model")
+            exp_id = username + "-" + exp_name.replace(" ", "") + "-" + str(update_time)
+            document = {
+                "id_experiment": exp_id,
+                "project_id": proj_id,
+                "name": exp_name,
+                "create_at": update_time,
+                "update_at": update_time,
+                "graphical_model": op["graphical_model"],
+                "revision": 0,
+            }
+            return InsertOne(document), exp_id, proj_id
+
+        if kind not in ("update", "delete"):
+            raise ValueError(f"unsupported operation: {kind}")
+        exp_id = op.get("id_experiment")
+        if not isinstance(exp_id, str):
+            raise ValueError(f"{kind} requires id_experiment")
+        if exp_id not in existing:
+            return None, exp_id, proj_id
+        query = {"id_experiment": exp_id, "project_id": proj_id}
+        if kind == "delete":
+            return DeleteOne(query), exp_id, proj_id
+
+        new_values = {"update_at": update_time}
+        if "exp_name" in op:
+            new_values["name"] = op["exp_name"]
+        if "graphical_model" in op:
+            new_values["graphical_model"] = op["graphical_model"]
+        if "project_id" in op:
+            if not isinstance(op["project_id"], str):
+                raise ValueError("project_id must be a string")
+            # moves the experiment to another project
+            new_values["project_id"] = op["project_id"]
+        if len(new_values) == 1:
+            raise ValueError("update requires exp_name, graphical_model or project_id")
+        update = UpdateOne(query, {"$set": new_values, "$inc": {"revision": 1}})
+        return update, exp_id, new_values.get("project_id", proj_id)
+
+
+experimentHandler = LazyInstance(ExperimentHandler)
@@ -0,0 +1,328 @@
+# JSON Patch (RFC 6902) on graphical models, with nodes and edges addressed by id. A patch is
+# one update_one when it fits in one update document, a read-modify-write of the graph otherwise
+from pymongo.errors import WriteError
+
+GRAPH_FIELD = "graphical_model"
+ID_ARRAYS = ("nodes", "edges")
+SUPPORTED_OPERATIONS = ("add", "remove", "replace")
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_pointer(path):
+    """Split a JSON pointer into field names that are safe to use in a MongoDB path."""
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"invalid path: {path}")
+    segments = [
+        segment.replace("~1", "/").replace("~0", "~") for segment in path[1:].split("/")
+    ]
+    for segment in segments:
+        if segment == "" or "." in segment or segment.startswith("$"):
+            raise PatchError(f"unsupported path segment in {path}")
+    return segments
+
+
+def revision_query(revision):
+    """Match the expected revision, documents written before revisions existed count as 0."""
+    if revision == 0:
+        return {"revision": {"$in": [0, None]}}
+    return {"revision": revision}
+
+
+class UpdateStage(object):
+    """One update document and the array filters it needs."""
+
+    def __init__(self):
+        self.operators = {}
+        self.array_filters = []
+        self.identifiers = {}
+        self.paths = []
+        # ids of the elements that must exist, per array
+        self.required = {}
+        # conditions on the fields that must exist, for replace
+        self.conditions = []
+
+    def resolve(self, path, element, allocate=False):
+        """Fill in the array filter identifier of the addressed element, if any."""
+        if element is None:
+            return path
+        if element not in self.identifiers:
+            name = f"e{len(self.identifiers)}"
+            if not allocate:
+                return path.format(name)
+            # MongoDB rejects array filters that are not used, so they are only added with their path
+            self.identifiers[element] = name
+            self.array_filters.append({f"{name}.id": element[1]})
+            self.require(f"{GRAPH_FIELD}.{element[0]}", element[1])
+        return path.format(self.identifiers[element])
+
+    def conflicts(self, operator, path):
+        for other_operator, other_path in self.paths:
+            # several $push or $pull on the same array are merged
+            mergeable = operator in ("$push", "$pull") and other_operator == operator
+            if mergeable and other_path == path:
+                continue
+            if is_prefix(other_path, path) or is_prefix(path, other_path):
+                return True
+        return False
+
+    def require(self, array, element_id):
+        self.required.setdefault(array, []).append(element_id)
+
+    def add(self, operator, path, value):
+        self.paths.append((operator, path))
+        fields = self.operators.setdefault(operator, {})
+        if operator == "$push":
+            fields.setdefault(path, {"$each": []})["$each"].append(value)
+        elif operator == "$pull":
+            removed = fields.setdefault(path, {"id": {"$in": []}})["id"]["$in"]
+            if value in removed:
+                raise PatchError(missing_element(path, value))
+            removed.append(value)
+            self.require(path, value)
+        else:
+            fields[path] = value
+
+    def query(self):
+        """Conditions matching the documents that hold every addressed element and field."""
+        query = {
+            f"{array}.id": {"$all": element_ids} for array, element_ids in self.required.items()
+        }
+        if len(self.conditions) > 0:
+            query["$and"] = self.conditions
+        return query
+
+
+def is_prefix(prefix, path):
+    return path == prefix or path.startswith(prefix + ".")
+
+
+def missing_element(array, element_id):
+    return f"{array.split('.')[-1]} has no element with id {element_id}"
+
+
+def parse_operation(operation):
+    """Validate one patch operation, returns (op, path segments, value)."""
+    if not isinstance(operation, dict):
+        raise PatchError("operations must be objects")
+    op = operation.get("op")
+    if op not in SUPPORTED_OPERATIONS:
+        raise PatchError(f"unsupported operation: {op}")
+    if op != "remove" and "value" not in operation:
+        raise PatchError(f"missing value for {op}")
+    segments = parse_pointer(operation.get("path"))
+    if segments[0] in ID_ARRAYS and len(segments) > 1 and segments[1] == "-":
+        if op != "add" or len(segments) > 2:
+            raise PatchError("'-' can only be used to append an element")
+    return op, segments, operation.get("value")
+
+
+def translate(operation):
+    """Return (operator, path, value, element) for one patch operation.
+
+    element is the (array, id) pair of an addressed node or edge, its array
+    filter identifier is left as a "{}" placeholder in path.
+    """
+    op, segments, value = parse_operation(operation)
+
+    if segments[0] in ID_ARRAYS and len(segments) > 1:
+        array = f"{GRAPH_FIELD}.{segments[0]}"
+        element_id = segments[1]
+        if element_id == "-":
+            return "$push", array, value, None
+        if op == "remove" and len(segments) == 2:
+            return "$pull", array, element_id, None
+        escaped = [segment.replace("{", "{{").replace("}", "}}") for segment in segments[2:]]
+        path = ".".join([array + ".$[{}]"] + escaped)
+        element = (segments[0], element_id)
+    else:
+        path = ".".join([GRAPH_FIELD] + segments)
+        element = None
+
+    if op == "remove":
+        return "$unset", path, "", element
+    return "$set", path, value, element
+
+
+def existence_query(segments):
+    """Condition matching the documents in which the addressed field exists.
+
+    None for a whole node or edge, whose existence is required by the stage.
+    """
+    if segments[0] in ID_ARRAYS and len(segments) > 1:
+        if len(segments) == 2:
+            return None
+        field = {".".join(segments[2:]): {"$exists": True}}
+        return {f"{GRAPH_FIELD}.{segments[0]}": {"$elemMatch": {"id": segments[1], **field}}}
+    return {".".join([GRAPH_FIELD] + segments): {"$exists": True}}
+
+
+def build_update_stages(operations):
+    """Group the operations into a list of UpdateStage, in the order they must be applied."""
+    if not isinstance(operations, list) or len(operations) == 0:
+        raise PatchError("operations must be a non-empty list")
+    stages = [UpdateStage()]
+    for operation in operations:
+        operator, path, value, element = translate(operation)
+        if stages[-1].conflicts(operator, stages[-1].resolve(path, element)):
+            stages.append(UpdateStage())
+        stages[-1].add(operator, stages[-1].resolve(path, element, allocate=True), value)
+        if operation["op"] == "replace":
+            condition = existence_query(parse_pointer(operation["path"]))
+            if condition is not None:
+                stages[-1].conditions.append(condition)
+    return stages
+
+
+def walk(document, keys, create):
+    """Follow keys like a MongoDB dotted path, creating missing objects if create is set.
+
+    Returns None when the path does not exist and create is not set.
+    """
+    for key in keys:
+        if isinstance(document, dict):
+            if key not in document:
+                if not create:
+                    return None
+                document[key] = {}
+            document = document[key]
+        elif isinstance(document, list) and key.isdigit() and int(key) < len(document):
+            document = document[int(key)]
+        elif create:
+            raise PatchError(f"cannot create field {key} in a {type(document).__name__}")
+        else:
+            return None
+    return document
+
+
+def field_exists(document, keys):
+    parent = walk(document, keys[:-1], create=False)
+    key = keys[-1]
+    if isinstance(parent, dict):
+        return key in parent
+    return isinstance(parent, list) and key.isdigit() and int(key) < len(parent)
+
+
+def set_field(document, keys, value):
+    parent = walk(document, keys[:-1], create=True)
+    key = keys[-1]
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list) and key.isdigit() and int(key) < len(parent):
+        parent[int(key)] = value
+    else:
+        raise PatchError(f"cannot create field {key} in a {type(parent).__name__}")
+
+
+def unset_field(document, keys):
+    parent = walk(document, keys[:-1], create=False)
+    key = keys[-1]
+    if isinstance(parent, dict):
+        parent.pop(key, None)
+    elif isinstance(parent, list) and key.isdigit() and int(key) < len(parent):
+        # $unset leaves null in arrays
+        parent[int(key)] = None
+
+
+def apply_operation(graph, operation):
+    """Apply one operation to a graphical model in memory, as its MongoDB update would."""
+    op, segments, value = parse_operation(operation)
+    if segments[0] not in ID_ARRAYS or len(segments) == 1:
+        if op == "replace" and not field_exists(graph, segments):
+            raise PatchError(f"replaced path does not exist: {operation['path']}")
+        if op == "remove":
+            unset_field(graph, segments)
+        else:
+            set_field(graph, segments, value)
+        return
+
+    name, element_id = segments[0], segments[1]
+    if element_id == "-":
+        array = graph.setdefault(name, [])
+        if not isinstance(array, list):
+            raise PatchError(f"{name} is not an array")
+        array.append(value)
+        return
+    array = graph.get(name)
+    if not isinstance(array, list):
+        raise PatchError(missing_element(name, element_id))
+    # like an array filter, the operation applies to every element with the id
+    matches = [
+        index
+        for index, element in enumerate(array)
+        if isinstance(element, dict) and element.get("id") == element_id
+    ]
+    if len(matches) == 0:
+        raise PatchError(missing_element(name, element_id))
+    if op == "replace" and len(segments) > 2:
+        if not all(field_exists(array[index], segments[2:]) for index in matches):
+            raise PatchError(f"replaced path does not exist: {operation['path']}")
+    for index in matches:
+        if len(segments) > 2:
+            if op == "remove":
+                unset_field(array[index], segments[2:])
+            else:
+                set_field(array[index], segments[2:], value)
+        elif op != "remove":
+            array[index] = value
+    if len(segments) == 2 and op == "remove":
+        graph[name] = [element for index, element in enumerate(array) if index not in matches]
+
+
+def apply_patch(collection, query, revision, operations, update_time):
+    """Apply the operations to the document matched by query if it is at the given revision.
+
+    Returns the new revision, or None when no document matched, i.e. it does
+    not exist or another client saved a newer revision in the meantime.
+    Raises PatchError if an operation cannot be applied, nothing is written then.
+    """
+    stages = build_update_stages(operations)
+    expected = {**query, **revision_query(revision)}
+    if len(stages) == 1:
+        return apply_update(collection, expected, stages[0], update_time, revision)
+    return rewrite_graph(collection, expected, operations, update_time, revision)
+
+
+def apply_update(collection, expected, stage, update_time, revision):
+    update = stage.operators
+    update.setdefault("$set", {})["update_at"] = update_time
+    # concurrent patches based on the same revision fail
+    update["$inc"] = {"revision": 1}
+    try:
+        result = collection.update_one(
+            {**expected, **stage.query()},
+            update,
+            array_filters=stage.array_filters or None,
+        )
+    except WriteError as e:
+        raise PatchError(f"operation could not be applied: {e}") from e
+    if result.matched_count == 1:
+        return revision + 1
+    # the document is at the revision, so an addressed element or replaced field is missing
+    addressed = len(stage.required) > 0 or len(stage.conditions) > 0
+    if addressed and collection.find_one(expected, {"_id": 1}) is not None:
+        raise PatchError("a node, edge or replaced field of the patch does not exist")
+    return None
+
+
+def rewrite_graph(collection, expected, operations, update_time, revision):
+    document = collection.find_one(expected, {"_id": 0, GRAPH_FIELD: 1})
+    if document is None:
+        return None
+    graph = document.get(GRAPH_FIELD)
+    if not isinstance(graph, dict):
+        graph = {}
+    for operation in operations:
+        apply_operation(graph, operation)
+    try:
+        result = collection.update_one(
+            expected,
+            {"$set": {GRAPH_FIELD: graph, "update_at": update_time}, "$inc": {"revision": 1}},
+        )
+    except WriteError as e:
+        raise PatchError(f"operation could not be applied: {e}") from e
+    if result.matched_count == 0:
+        return None
+    return revision + 1
@@ -0,0 +1,35 @@
+# Lazily built, per-process singletons: nothing connects until first use, and a forked
+# process builds its own instance, so clients and threads are never shared across a fork
+import os
+import threading
+
+
+class LazyInstance(object):
+    def __init__(self, factory):
+        # set through __dict__, attribute access is forwarded to the instance
+        self.__dict__["_factory"] = factory
+        self.__dict__["_instance"] = None
+        self.__dict__["_pid"] = None
+        self.__dict__["_lock"] = threading.RLock()
+        os.register_at_fork(after_in_child=self.__reset_lock)
+
+    def __reset_lock(self):
+        # the lock may have been held by another thread of the parent when it forked
+        self.__dict__["_lock"] = threading.RLock()
+
+    # named so that it does not hide a method of the instance
+    def get_instance(self):
+        """Return the instance of this process, building it on first use."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # the instance is only published once it is fully built
+                    self.__dict__["_instance"] = self._factory()
+                    self.__dict__["_pid"] = os.getpid()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_instance(), name, value)
@@ -0,0 +1,118 @@
+# In-memory snapshot of the official categories and tasks, reseeded when the SHA-256 of the
+# seed file changes. Snapshot documents are shared between requests and must not be modified
+import hashlib
+import json
+import threading
+import time
+from blobStore import blobStore
+from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from serializer import serialize_documents
+
+SEED_FILE = "../tasks/official_tasks.json"
+META_ID = "official_catalog"
+REFRESH_INTERVAL = 60  # seconds
+
+
+class CatalogSnapshot(object):
+    def __init__(self, version, categories, tasks):
+        self.version = version
+        self.categories = tuple(categories)
+        tasks_by_category = {}
+        for task in tasks:
+            tasks_by_category.setdefault(task["category_id"], []).append(task)
+        self.tasks_by_category = {
+            category_id: tuple(category_tasks)
+            for category_id, category_tasks in tasks_by_category.items()
+        }
+
+
+class OfficialCatalog(object):
+    def __init__(self):
+        self.client = mongo_client
+        self.db = self.client.tasks
+        self.collection_category = self.db.category
+        self.collection_task = self.db.task
+        self.collection_meta = self.db.meta
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0
+        self.init_indexes()
+        self.seed()
+
+    # the seed upserts by id, without the unique indexes concurrent seeds of several
+    # workers on an empty database could insert the same document twice
+    def init_indexes(self):
+        self.collection_category.create_index("id_category", unique=True)
+        self.collection_task.create_index("id_task", unique=True)
+
+    def seed(self):
+        """Write the seed file to MongoDB if its version is not the recorded one, then load the snapshot."""
+        with open(SEED_FILE, "rb") as f:
+            raw = f.read()
+        version = hashlib.sha256(raw).hexdigest()
+        if self.__recorded_version() != version:
+            data = json.loads(raw)
+            self.__replace_official(data["category"], data["task"])
+            self.collection_meta.update_one(
+                {"_id": META_ID}, {"$set": {"version": version}}, upsert=True
+            )
+        self.__load(version)
+
+    def __recorded_version(self):
+        document = self.collection_meta.find_one({"_id": META_ID})
+        return None if document is None else document.get("version")
+
+    def __replace_official(self, categories, tasks):
+        for category in categories:
+            self.collection_category.replace_one(
+                {"id_category": category["id_category"]}, category, upsert=True
+            )
+        for task in tasks:
+            self.collection_task.replace_one({"id_task": task["id_task"]}, task, upsert=True)
+        # official entries removed from the seed file are removed as well
+        self.collection_category.delete_many(
+            {
+                "is_official": True,
+                "id_category": {"$nin": [c["id_category"] for c in categories]},
+            }
+        )
+        self.collection_task.delete_many(
+            {"is_user_defined": False, "id_task": {"$nin": [t["id_task"] for t in tasks]}}
+        )
+
+    def __load(self, version):
+        categories = serialize_documents(self.collection_category.find({"is_official": True}))
+        tasks = serialize_documents(self.collection_task.find({"is_user_defined": False}))
+        for task in tasks:
+            blobStore.hydrate_document(task)
+        snapshot = CatalogSnapshot(version, categories, tasks)
+        with self.lock:
+            self.snapshot = snapshot
+            self.checked_at = time.monotonic()
+
+    def get_snapshot(self):
+        with self.lock:
+            snapshot = self.snapshot
+            stale = time.monotonic() - self.checked_at > REFRESH_INTERVAL
+            if stale:
+                # only one request pays for the version check
+                self.checked_at = time.monotonic()
+        if stale:
+            version = self.__recorded_version()
+            if version != snapshot.version:
+                self.__load(version)
+                return self.snapshot
+        return snapshot
+
+    def get_categories(self):
+        return self.get_snapshot().categories
+
+    def get_tasks(self, category_id):
+        return self.get_snapshot().tasks_by_category.get(category_id, ())
+
+    def get_version(self):
+        return self.get_snapshot().version
+
+
+officialCatalog = LazyInstance(OfficialCatalog)
@@ -0,0 +1,52 @@
+# Keyset pagination on (update_at, id), both descending: a page is a range query on the
+# compound index, its cost does not grow with its depth
+import base64
+import json
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(update_at, doc_id):
+    raw = json.dumps([update_at, doc_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (update_at, doc_id), raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        update_at, doc_id = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(update_at, (int, float)) or not isinstance(doc_id, str):
+        raise ValueError("invalid cursor")
+    return update_at, doc_id
+
+
+def parse_page_args(args):
+    """Read limit and after from the request args, a limit of 0 returns everything."""
+    limit = int(args.get("limit", 0))
+    if limit < 0:
+        raise ValueError("invalid limit")
+    limit = min(limit, MAX_PAGE_SIZE)
+    after = args.get("after")
+    if after is not None:
+        decode_cursor(after)
+    return limit, after
+
+
+def after_query(cursor, id_field):
+    """Conditions selecting the documents that sort after the cursor."""
+    update_at, doc_id = decode_cursor(cursor)
+    return {
+        "update_at": {"$lte": update_at},
+        "$or": [{"update_at": {"$lt": update_at}}, {id_field: {"$lt": doc_id}}],
+    }
+
+
+def next_cursor(documents, limit, id_field):
+    """Cursor of the following page, None when the last page was returned."""
+    if limit == 0 or len(documents) < limit:
+        return None
+    last = documents[-1]
+    return encode_cursor(last["update_at"], last[id_field])
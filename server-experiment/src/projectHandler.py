@@ -1,8 +1,18 @@
+import os
 import pymongo
-import json
+from pymongo.errors import DuplicateKeyError
 import time
 import calendar
 from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from pagination import after_query
+from serializer import serialize_document, serialize_documents
+from uniqueName import UniqueName
+from writeBehind import WriteBehindBuffer
+
+
+# fields returned by the summary listing
+SUMMARY_PROJECTION = {"_id": 0, "id_project": 1, "name": 1, "create_at": 1, "update_at": 1}
 
 
 class ProjectHandler(object):
@@ -10,19 +20,67 @@ class ProjectHandler(object):
         self.client = mongo_client
         self.db = self.client.experiments
         self.collection_project = self.db.project
+        self.init_indexes()
+        # update_at bumps caused by experiment writes are coalesced and written in the background.
+        # With several workers the next request of a user may be served by another process,
+        # which cannot flush this buffer, so update_at is written synchronously instead
+        self.update_at_buffer = None
+        if int(os.environ.get("EXP_WORKERS", "1")) <= 1:
+            self.update_at_buffer = WriteBehindBuffer(self.collection_project, "id_project")
+            self.update_at_buffer.start()
+
+    def init_indexes(self):
+        self.collection_project.create_index("id_project", unique=True)
+        # get_projects: find by owner, sorted and paginated by (update_at, id_project)
+        self.collection_project.create_index(
+            [
+                ("owner", pymongo.ASCENDING),
+                ("update_at", pymongo.DESCENDING),
+                ("id_project", pymongo.DESCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # project names are unique per owner
+        self.unique_name = UniqueName(self.collection_project, "owner", "id_project")
 
-    def get_projects(self, username):
+    # write the buffered update_at of the owner's projects, so that a user reads their own writes
+    def flush_update_at(self, username):
+        if self.update_at_buffer is None or not self.update_at_buffer.has_pending():
+            return
+        documents = self.collection_project.find(
+            {"owner": username}, {"_id": 0, "id_project": 1}
+        )
+        self.update_at_buffer.flush([doc["id_project"] for doc in documents])
+
+    def get_projects(self, username, summary=False, limit=0, after=None):
+        self.flush_update_at(username)
         query = {"owner": username}
-        documents = self.collection_project.find(query).sort(
-            "update_at", pymongo.DESCENDING
+        if after is not None:
+            query.update(after_query(after, "id_project"))
+        projection = SUMMARY_PROJECTION if summary else None
+        documents = (
+            self.collection_project.find(query, projection)
+            .sort([("update_at", pymongo.DESCENDING), ("id_project", pymongo.DESCENDING)])
+            .limit(limit)
         )
-        # return documents in JSON format
-        return json.loads(json.dumps(list(documents), default=str))
+        # return documents in JSON compatible format
+        return serialize_documents(documents)
+
+    # (id, revision) of the owner's projects in listing order, answered from the index
+    def get_projects_versions(self, username):
+        self.flush_update_at(username)
+        query = {"owner": username}
+        documents = self.collection_project.find(
+            query, {"_id": 0, "id_project": 1, "revision": 1}
+        ).sort([("update_at", pymongo.DESCENDING), ("id_project", pymongo.DESCENDING)])
+        return [[doc["id_project"], doc.get("revision", 0)] for doc in documents]
 
     def get_project(self, proj_id):
+        if self.update_at_buffer is not None:
+            self.update_at_buffer.flush([proj_id])
         query = {"id_project": proj_id}
         documents = self.collection_project.find(query)
-        return json.loads(json.dumps(documents[0], default=str))
+        return serialize_document(documents[0])
 
     def project_exists(self, proj_id):
         query = {"id_project": proj_id}
@@ -32,6 +90,12 @@ class ProjectHandler(object):
                 return True
         return False
 
+    # the ids among proj_ids of projects owned by the user, with a single query
+    def get_owned_project_ids(self, username, proj_ids):
+        query = {"id_project": {"$in": list(proj_ids)}, "owner": username}
+        documents = self.collection_project.find(query, {"_id": 0, "id_project": 1})
+        return set(doc["id_project"] for doc in documents)
+
     def create_project(self, username, proj_name):
         create_time = calendar.timegm(time.gmtime())  # get current time in seconds
         proj_id = username + "-" + proj_name.replace(" ", "") + "-" + str(create_time)
@@ -42,19 +106,17 @@ class ProjectHandler(object):
             "create_at": create_time,
             "update_at": create_time,
             "description": "This project has no description yet.",
+            "revision": 0,
         }
-        self.collection_project.insert_one(query)
+        # returns None if the owner already has a project with this name
+        if self.unique_name.is_taken(username, proj_name):
+            return None
+        try:
+            self.collection_project.insert_one(query)
+        except DuplicateKeyError:
+            return None
         return proj_id
 
-    # FIXME: bad implementation
-    def detect_duplicate(self, username, proj_name):
-        query = {"owner": username}
-        documents = self.collection_project.find(query)
-        for doc in documents:
-            if doc["name"] == proj_name:
-                return True
-        return False
-
     def update_project_info(self, proj_id, proj_name, description):
         update_time = calendar.timegm(time.gmtime())
         query = {"id_project": proj_id}
@@ -63,9 +125,16 @@ class ProjectHandler(object):
                 "name": proj_name,
                 "description": description,
                 "update_at": update_time,
-            }
+            },
+            "$inc": {"revision": 1},
         }
-        self.collection_project.update_one(query, new_values)
+        # returns False if the owner already has another project with this name
+        if self.unique_name.is_taken_by_other(proj_id, proj_name):
+            return False
+        try:
+            self.collection_project.update_one(query, new_values)
+        except DuplicateKeyError:
+            return False
         return True
 
     def delete_project(self, proj_id):
@@ -73,12 +142,16 @@ class ProjectHandler(object):
         self.collection_project.delete_one(query)
         return True
 
+    # buffered, written with $max by the next flush of update_at_buffer
     def update_project_update_at(self, proj_id):
         update_time = calendar.timegm(time.gmtime())
+        if self.update_at_buffer is not None:
+            self.update_at_buffer.add(proj_id, update_time)
+            return True
         query = {"id_project": proj_id}
-        new_values = {"$set": {"update_at": update_time}}
+        new_values = {"$max": {"update_at": update_time}, "$inc": {"revision": 1}}
         self.collection_project.update_one(query, new_values)
         return True
 
 
-projectHandler = ProjectHandler()
+projectHandler = LazyInstance(ProjectHandler)
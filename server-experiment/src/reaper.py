@@ -0,0 +1,145 @@
+# Deletes the children of deleted projects and categories in the background, in batches. Jobs
+# are stored in MongoDB, a deletion interrupted by a restart is resumed
+import calendar
+import datetime
+import threading
+import time
+from pymongo.errors import PyMongoError
+from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from serializer import serialize_document
+
+BATCH_SIZE = 500
+# pause between batches, leaves room for the requests served by the same database
+BATCH_PAUSE = 0.05  # seconds
+POLL_INTERVAL = 30  # seconds
+# finished jobs are kept for progress requests, then removed by a TTL index
+FINISHED_JOB_TTL = 24 * 60 * 60  # seconds
+
+PENDING = "pending"
+DONE = "done"
+
+
+class DeletionKind(object):
+    def __init__(self, parent_collection, parent_field, child_collection, child_field):
+        self.parent_collection = parent_collection
+        self.parent_field = parent_field
+        self.child_collection = child_collection
+        self.child_field = child_field
+
+
+class Reaper(object):
+    def __init__(self):
+        self.client = mongo_client
+        self.db = self.client.experiments
+        self.collection_job = self.db.deletion_job
+        self.kinds = {
+            "project": DeletionKind(
+                self.client.experiments.project,
+                "id_project",
+                self.client.experiments.experiment,
+                "project_id",
+            ),
+            "category": DeletionKind(
+                self.client.tasks.category,
+                "id_category",
+                self.client.tasks.task,
+                "category_id",
+            ),
+        }
+        self.wake = threading.Event()
+        self.thread = None
+        self.init_indexes()
+
+    def init_indexes(self):
+        self.collection_job.create_index("status")
+        self.collection_job.create_index("finished_at", expireAfterSeconds=FINISHED_JOB_TTL)
+
+    def start(self):
+        """Start the worker thread, pending jobs of a previous run are resumed."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.__run, name="reaper", daemon=True)
+        self.thread.start()
+        self.wake.set()
+
+    def schedule(self, kind, parent_id):
+        """Record the deletion of a parent, remove it and return the job."""
+        spec = self.kinds[kind]
+        now = calendar.timegm(time.gmtime())
+        job_id = f"{kind}:{parent_id}"
+        # the job is recorded first, if the service stops before the parent is removed
+        # the worker removes it when the job is resumed
+        self.collection_job.update_one(
+            {"_id": job_id},
+            {
+                "$setOnInsert": {
+                    "kind": kind,
+                    "parent_id": parent_id,
+                    "status": PENDING,
+                    "deleted": 0,
+                    "create_at": now,
+                    "update_at": now,
+                }
+            },
+            upsert=True,
+        )
+        spec.parent_collection.delete_one({spec.parent_field: parent_id})
+        self.wake.set()
+        return self.get_job(kind, parent_id)
+
+    def get_job(self, kind, parent_id):
+        """Progress of the deletion of a parent, None if it was never deleted."""
+        document = self.collection_job.find_one({"_id": f"{kind}:{parent_id}"})
+        return serialize_document(document)
+
+    def __run(self):
+        while True:
+            self.wake.wait(POLL_INTERVAL)
+            self.wake.clear()
+            try:
+                for job in self.pending_jobs():
+                    self.reap(job)
+            except PyMongoError as e:
+                # the jobs stay pending and are retried on the next run
+                print(f"Error deleting children: {e}")
+
+    def pending_jobs(self):
+        return self.collection_job.find({"status": PENDING})
+
+    def reap(self, job):
+        spec = self.kinds[job["kind"]]
+        parent_id = job["parent_id"]
+        spec.parent_collection.delete_one({spec.parent_field: parent_id})
+        while True:
+            documents = spec.child_collection.find(
+                {spec.child_field: parent_id}, {"_id": 1}
+            ).limit(BATCH_SIZE)
+            ids = [doc["_id"] for doc in documents]
+            if len(ids) == 0:
+                break
+            result = spec.child_collection.delete_many({"_id": {"$in": ids}})
+            self.collection_job.update_one(
+                {"_id": job["_id"]},
+                {
+                    "$inc": {"deleted": result.deleted_count},
+                    "$set": {"update_at": calendar.timegm(time.gmtime())},
+                },
+            )
+            time.sleep(BATCH_PAUSE)
+
+        self.collection_job.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": DONE,
+                    "update_at": calendar.timegm(time.gmtime()),
+                    # TTL indexes only expire dates
+                    "finished_at": datetime.datetime.utcnow(),
+                }
+            },
+        )
+        print(f"Deleted {job['_id']} and its children")
+
+
+reaper = LazyInstance(Reaper)
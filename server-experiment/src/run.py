@@ -1,4 +1,94 @@
+import os
+import signal
+import socket
+import sys
+
+# EXP_SERVER_MODE=async serves the same app on gevent: pymongo and requests become cooperative,
+# so a single process keeps thousands of requests in flight while they wait on Mongo or HTTP
+SERVER_MODE = os.environ.get("EXP_SERVER_MODE", "threaded")
+# concurrent requests served by one process in async mode
+MAX_CONNECTIONS = int(os.environ.get("EXP_MAX_CONNECTIONS", "5000"))
+# EXP_WORKERS > 1 forks worker processes that accept connections on a shared socket
+WORKERS = int(os.environ.get("EXP_WORKERS", "1"))
+
+HOST = "0.0.0.0"
+PORT = 5050
+
+if SERVER_MODE == "async":
+    # must run before anything imports socket, ssl or threading
+    from gevent import monkey
+
+    monkey.patch_all()
+
+# builds no handler, nothing is connected before the workers are forked
 from api import app
+from startup import startup
+
+
+def run_threaded(listener=None):
+    # exit through sys.exit on docker stop, so that buffered writes are flushed by atexit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    startup.start()
+    if listener is None:
+        app.run(host = HOST, port = PORT, debug = False)
+        return
+    from werkzeug.serving import make_server
+
+    make_server(HOST, PORT, app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def run_async(listener=None):
+    import gevent
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    server = WSGIServer(listener or (HOST, PORT), app, spawn=Pool(MAX_CONNECTIONS))
+    # serve_forever returns on docker stop, buffered writes are then flushed by atexit
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+    startup.start()
+    server.serve_forever()
+
+
+def run_workers(serve, workers):
+    """Bind the socket, fork the workers and replace those that exit until stopped."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, PORT))
+    listener.listen(1024)
+
+    children = set()
+    stopping = []
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            # each worker connects and warms up on its own
+            serve(listener)
+            sys.exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    for _ in range(workers):
+        fork_worker()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on port {PORT} with {workers} workers")
+
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, starting a new one")
+            fork_worker()
+
 
 if __name__ == '__main__':
-    app.run(host = '0.0.0.0', port = 5050, debug = False)
\ No newline at end of file
+    serve = run_async if SERVER_MODE == "async" else run_threaded
+    if WORKERS > 1:
+        run_workers(serve, WORKERS)
+    else:
+        serve()
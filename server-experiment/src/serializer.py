@@ -0,0 +1,35 @@
+# Conversion of MongoDB documents into JSON compatible values in a single walk, in place,
+# instead of a json.dumps(default=str) / json.loads round trip
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def serialize_value(value):
+    """Return a JSON compatible version of value, containers are converted in place."""
+    if isinstance(value, JSON_SCALARS):
+        return value
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(item, JSON_SCALARS):
+                value[key] = serialize_value(item)
+        return value
+    if isinstance(value, list):
+        for index, item in enumerate(value):
+            if not isinstance(item, JSON_SCALARS):
+                value[index] = serialize_value(item)
+        return value
+    if isinstance(value, tuple):
+        return serialize_value(list(value))
+    # ObjectId, datetime, Decimal128, ... are rendered like json.dumps(default=str)
+    return str(value)
+
+
+def serialize_document(document):
+    """Convert a single document, None stays None."""
+    if document is None:
+        return None
+    return serialize_value(document)
+
+
+def serialize_documents(documents):
+    """Convert the documents of a cursor while it is iterated."""
+    return [serialize_value(document) for document in documents]
@@ -0,0 +1,82 @@
+# Per-process warm-up of the handler singletons in a background thread, GET /exp/ready
+# reports when it finished. The EMF convertor is warmed up on a best-effort basis
+import os
+import threading
+import time
+from blobStore import blobStore
+from categoryHandler import categoryHandler
+from convertorHandler import convertorHandler
+from experimentHandler import experimentHandler
+from officialCatalog import officialCatalog
+from projectHandler import projectHandler
+from reaper import reaper
+from taskHandler import taskHandler
+from userAuthHandler import userAuthHandler
+
+RETRY_INTERVAL = 5  # seconds
+
+# built before the process reports ready, each process creates the indexes of the
+# handlers again, create_index is a no-op when the index already exists
+REQUIRED = (
+    userAuthHandler,
+    blobStore,
+    officialCatalog,
+    projectHandler,
+    experimentHandler,
+    categoryHandler,
+    taskHandler,
+    reaper,
+)
+
+
+class Startup(object):
+    def __init__(self):
+        self.pid = None
+        self.ready = False
+        self.error = None
+        self.startup_time = None
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.__reset_lock)
+
+    def __reset_lock(self):
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the warm-up of this process, further calls are no-ops."""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.ready = False
+            self.error = None
+            thread = threading.Thread(target=self.__warm_up, name="warm-up", daemon=True)
+            thread.start()
+
+    def __warm_up(self):
+        started = time.monotonic()
+        while True:
+            try:
+                for instance in REQUIRED:
+                    instance.get_instance()
+                # resumes the deletions left unfinished by a previous run
+                reaper.start()
+                break
+            except Exception as e:
+                self.error = str(e)
+                print(f"Warm-up of process {self.pid} failed, retrying: {e}")
+                time.sleep(RETRY_INTERVAL)
+        self.startup_time = time.monotonic() - started
+        self.error = None
+        self.ready = True
+        print(f"Process {self.pid} ready in {self.startup_time:.2f} s")
+
+        try:
+            convertorHandler.get_instance()
+        except Exception as e:
+            # built again by the first conversion
+            print(f"EMF service not available yet: {e}")
+
+
+startup = Startup()
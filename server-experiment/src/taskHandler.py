@@ -1,7 +1,29 @@
-import json
 import time
 import calendar
+import pymongo
+from pymongo.errors import DuplicateKeyError
+from blobStore import blobStore
 from dbClient import mongo_client
+from lazyInstance import LazyInstance
+from graphPatch import apply_patch
+from officialCatalog import officialCatalog
+from serializer import serialize_document, serialize_documents
+from uniqueName import UniqueName
+
+
+# fields returned by the summary listing, the graphical model is only sent by get_task
+SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id_task": 1,
+    "name": 1,
+    "category_id": 1,
+    "is_user_defined": 1,
+    "owner": 1,
+    "provider": 1,
+    "description": 1,
+    "create_at": 1,
+    "update_at": 1,
+}
 
 
 class TaskHandler(object):
@@ -9,31 +31,126 @@ class TaskHandler(object):
         self.client = mongo_client
         self.db = self.client.tasks
         self.collection_task = self.db.task
-        if self.collection_task.count_documents({}) == 0:
-            with open("../tasks/official_tasks.json") as f:
-                data = json.load(f)
-                for task in data["task"]:
-                    self.collection_task.insert_one(task)
-                f.close()
-
-    def get_official_tasks_by_category(self, category_id):
-        query = {"category_id": category_id, "is_user_defined": False}
-        documents = self.collection_task.find(query)
-        return json.loads(json.dumps(list(documents), default=str))
-
-    def get_tasks(self, category_id, username):
+        self.init_indexes()
+
+    def init_indexes(self):
+        self.collection_task.create_index("id_task", unique=True)
+        # get_task_version
+        self.collection_task.create_index(
+            [
+                ("id_task", pymongo.ASCENDING),
+                ("is_user_defined", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # get_tasks, get_tasks_versions and delete_tasks: find by category_id and owner
+        self.collection_task.create_index(
+            [
+                ("category_id", pymongo.ASCENDING),
+                ("owner", pymongo.ASCENDING),
+                ("id_task", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # get_catalog and get_user_tasks_versions: all tasks of a user
+        self.collection_task.create_index(
+            [
+                ("owner", pymongo.ASCENDING),
+                ("id_task", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # official tasks, loaded and reseeded by the official catalog
+        self.collection_task.create_index(
+            [
+                ("is_user_defined", pymongo.ASCENDING),
+                ("id_task", pymongo.ASCENDING),
+                ("revision", pymongo.ASCENDING),
+            ]
+        )
+        # task names are unique per category
+        self.unique_name = UniqueName(self.collection_task, "category_id", "id_task")
+
+    # served from the in-memory catalog, the documents are shared and must not be modified
+    def get_official_tasks_by_category(self, category_id, summary=False):
+        tasks = officialCatalog.get_tasks(category_id)
+        if summary:
+            return [
+                {key: value for key, value in task.items() if SUMMARY_PROJECTION.get(key)}
+                for task in tasks
+            ]
+        return list(tasks)
+
+    def get_tasks(self, category_id, username, summary=False):
         query = {"category_id": category_id, "owner": username}
-        documents = self.collection_task.find(query)
+        projection = SUMMARY_PROJECTION if summary else None
+        documents = self.collection_task.find(query, projection)
 
-        official_tasks = self.get_official_tasks_by_category(category_id)
-        user_tasks = json.loads(json.dumps(list(documents), default=str))
+        official_tasks = self.get_official_tasks_by_category(category_id, summary)
+        user_tasks = serialize_documents(documents)
 
         # tasks = (official_tasks + user_tasks).sort(
         #     key=lambda x: x["update_at"], reverse=True
         # )
         tasks = official_tasks + user_tasks
+        if not summary:
+            # official tasks are hydrated when the catalog is loaded
+            for task in user_tasks:
+                blobStore.hydrate_document(task)
         return tasks
 
+    # (id, revision) of the tasks returned by get_tasks, the user's are answered from the index
+    def get_tasks_versions(self, category_id, username):
+        projection = {"_id": 0, "id_task": 1, "revision": 1}
+        versions = [["official", officialCatalog.get_version()]]
+        versions += [
+            [doc["id_task"], doc.get("revision", 0)]
+            for doc in officialCatalog.get_tasks(category_id)
+        ]
+        query = {"category_id": category_id, "owner": username}
+        documents = self.collection_task.find(query, projection)
+        versions += [[doc["id_task"], doc.get("revision", 0)] for doc in documents]
+        return versions
+
+    # categories with the summaries of their official and user tasks, built from a single
+    # query on the user's tasks instead of one request per category
+    def get_catalog(self, categories, username):
+        query = {"owner": username}
+        documents = self.collection_task.find(query, SUMMARY_PROJECTION)
+        user_tasks = {}
+        for task in documents:
+            user_tasks.setdefault(task["category_id"], []).append(task)
+
+        catalog = []
+        for category in categories:
+            category_id = category["id_category"]
+            tasks = self.get_official_tasks_by_category(category_id, summary=True)
+            tasks += serialize_documents(user_tasks.get(category_id, []))
+            # official categories are shared, the tasks are added to a copy
+            catalog.append({**category, "tasks": tasks})
+        return catalog
+
+    # (id, revision) of all tasks of the user, answered from the index
+    def get_user_tasks_versions(self, username):
+        query = {"owner": username}
+        projection = {"_id": 0, "id_task": 1, "revision": 1}
+        documents = self.collection_task.find(query, projection)
+        return [[doc["id_task"], doc.get("revision", 0)] for doc in documents]
+
+    # version of the task without loading it, None if it does not exist. Reseeding keeps
+    # the revision of official tasks, so their version includes the catalog version
+    def get_task_version(self, task_id):
+        query = {"id_task": task_id}
+        document = self.collection_task.find_one(
+            query, {"_id": 0, "is_user_defined": 1, "revision": 1}
+        )
+        if document is None:
+            return None
+        version = [document.get("revision", 0)]
+        if not document.get("is_user_defined", False):
+            version.append(officialCatalog.get_version())
+        return version
+
     def task_exists(self, task_id):
         query = {"id_task": task_id}
         documents = self.collection_task.find(query)
@@ -45,9 +162,14 @@ class TaskHandler(object):
     def get_task(self, task_id):
         query = {"id_task": task_id}
         documents = self.collection_task.find(query)
-        return json.loads(json.dumps(documents[0], default=str))
+        return blobStore.hydrate_document(serialize_document(documents[0]))
 
     def create_task(self, username, category_id, task_name, provider, graphical_model):
+        # returns None if the category already has a task with this name, checked before
+        # the nested graphs are stored so that a rejected create writes nothing
+        nested = blobStore.has_nested_graphs(graphical_model)
+        if self.unique_name.is_taken(category_id, task_name, force=nested):
+            return None
         create_time = calendar.timegm(time.gmtime())
         task_id = username + "-" + task_name.replace(" ", "") + "-" + str(create_time)
         query = {
@@ -60,9 +182,13 @@ class TaskHandler(object):
             "description": "This task has no description yet.",
             "create_at": create_time,
             "update_at": create_time,
-            "graphical_model": graphical_model,
+            "graphical_model": blobStore.dehydrate_graph(graphical_model),
+            "revision": 0,
         }
-        self.collection_task.insert_one(query)
+        try:
+            self.collection_task.insert_one(query)
+        except DuplicateKeyError:
+            return None
 
         return task_id
 
@@ -74,15 +200,6 @@ class TaskHandler(object):
         query = {"category_id": category_id}
         self.collection_task.delete_many(query)
 
-    # FIXME: bad implementation
-    def detect_duplicate(self, category_id, task_name):
-        query = {"category_id": category_id, "name": task_name}
-        documents = self.collection_task.find(query)
-        for doc in documents:
-            if doc["name"] == task_name:
-                return True
-        return False
-
     def update_task_info(self, task_id, task_name, task_description):
         update_time = calendar.timegm(time.gmtime())
         query = {"id_task": task_id}
@@ -91,9 +208,16 @@ class TaskHandler(object):
                 "name": task_name,
                 "description": task_description,
                 "update_at": update_time,
-            }
+            },
+            "$inc": {"revision": 1},
         }
-        self.collection_task.update_one(query, new_values)
+        # returns False if the category already has another task with this name
+        if self.unique_name.is_taken_by_other(task_id, task_name):
+            return False
+        try:
+            self.collection_task.update_one(query, new_values)
+        except DuplicateKeyError:
+            return False
 
         return True
 
@@ -101,11 +225,23 @@ class TaskHandler(object):
         update_time = calendar.timegm(time.gmtime())
         query = {"id_task": task_id}
         new_values = {
-            "$set": {"graphical_model": graphical_model, "update_at": update_time}
+            "$set": {
+                "graphical_model": blobStore.dehydrate_graph(graphical_model),
+                "update_at": update_time,
+            },
+            "$inc": {"revision": 1},
         }
         self.collection_task.update_one(query, new_values)
 
         return True
 
 
-taskHandler = TaskHandler()
+    # apply JSON Patch operations to the graphical model, returns the new revision
+    # or None if the task is not at the expected revision anymore
+    def patch_task_graphical_model(self, task_id, revision, operations):
+        update_time = calendar.timegm(time.gmtime())
+        query = {"id_task": task_id}
+        return apply_patch(self.collection_task, query, revision, operations, update_time)
+
+
+taskHandler = LazyInstance(TaskHandler)
@@ -0,0 +1,82 @@
+# Unique names per scope backed by a unique (scope, name) index. While duplicates prevent the
+# index, names are checked with a query before each write and the build is retried
+import threading
+import time
+import pymongo
+from pymongo.errors import OperationFailure
+
+RETRY_INTERVAL = 60  # seconds
+
+# UniqueName of each collection, reported by the readiness check
+registry = {}
+
+
+class UniqueName(object):
+    def __init__(self, collection, scope_field, id_field):
+        self.collection = collection
+        self.scope_field = scope_field
+        self.id_field = id_field
+        self.indexed = False
+        self.attempted_at = 0
+        self.lock = threading.Lock()
+        self.create_index()
+        registry[self.describe()] = self
+
+    def describe(self):
+        return f"{self.collection.full_name} ({self.scope_field}, name)"
+
+    def create_index(self):
+        """Create the unique (scope, name) index, returns whether it exists."""
+        self.attempted_at = time.monotonic()
+        try:
+            self.collection.create_index(
+                [(self.scope_field, pymongo.ASCENDING), ("name", pymongo.ASCENDING)],
+                unique=True,
+            )
+        except OperationFailure as e:
+            print(
+                f"WARNING: unique index on {self.describe()} not created, "
+                f"names are checked before each write until it exists: {e}"
+            )
+            return False
+        self.indexed = True
+        return True
+
+    def __check_needed(self):
+        if self.indexed:
+            return False
+        # only one request retries the build, the others use the check
+        if time.monotonic() - self.attempted_at > RETRY_INTERVAL and self.lock.acquire(False):
+            try:
+                self.create_index()
+            finally:
+                self.lock.release()
+        return not self.indexed
+
+    def is_taken(self, scope, name, doc_id=None, force=False):
+        """Whether a document other than doc_id has the name in the scope.
+
+        Always False once the unique index exists, the write itself fails then,
+        unless force is set: callers that write something else before the
+        document check the name first.
+        """
+        if not self.__check_needed() and not force:
+            return False
+        query = {self.scope_field: scope, "name": name}
+        if doc_id is not None:
+            query[self.id_field] = {"$ne": doc_id}
+        return self.collection.find_one(query, {"_id": 1}) is not None
+
+    def is_taken_by_other(self, doc_id, name):
+        """Whether another document of the scope of doc_id has the name, for renames."""
+        if not self.__check_needed():
+            return False
+        document = self.collection.find_one({self.id_field: doc_id}, {self.scope_field: 1})
+        if document is None:
+            return False
+        return self.is_taken(document.get(self.scope_field), name, doc_id)
+
+
+def missing_indexes():
+    """Unique name indexes this process could not create."""
+    return [unique.describe() for unique in registry.values() if not unique.indexed]
@@ -1,22 +1,158 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from lazyInstance import LazyInstance
+
+# seconds, a hung access control call must not hold the requests waiting for it
+REQUEST_TIMEOUT = 5
+# result of a verification the access control service did not answer, it is not cached
+UNAVAILABLE = {
+    "valid": False,
+    "unavailable": True,
+    "error_type": "authentication service unavailable",
+}
+
+
+class VerificationCache(object):
+    """Bounded LRU cache of verification results, each entry has its own expiry time."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, expire_at):
+        with self.lock:
+            self.entries[key] = (value, expire_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
 
 class UserAuthHandler(object):
     def __init__(self):
-        # host depend on the host url of auth-service 
+        # host depend on the host url of auth-service
         # or the name of the container of auth-service in docker-compose.yml if you use docker-compose
-        self.userAuthUrl = "http://access-control-service:5521/extreme_auth/api/v1/person/userinfo" 
+        self.userAuthUrl = "http://access-control-service:5521/extreme_auth/api/v1/person/userinfo"
+        self.cache_ttl = 60  # seconds, a cached result never outlives the token itself
+        self.cache = VerificationCache(max_size=10000)
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        # keep-alive connections to the access control service are reused across requests
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=32))
+        # "remote" asks the access control service for every new token,
+        # "jwks" verifies the token locally against the key set of the identity provider
+        self.mode = os.environ.get("EXP_AUTH_MODE", "remote")
+        # compose passes an unset variable as an empty string
+        algorithms = os.environ.get("OIDC_RP_SIGN_ALGO") or "RS256"
+        self.algorithms = [name.strip() for name in algorithms.split(",") if name.strip()]
+        self.jwks_client = None
+        if self.mode == "jwks":
+            # the key set is fetched on first use, cached, and refetched when a token has an unknown kid
+            self.jwks_client = jwt.PyJWKClient(
+                os.environ["OIDC_OP_JWKS_ENDPOINT"], cache_jwk_set=True, lifespan=3600
+            )
 
     def verify_user(self, token):
-        r = requests.get(url = self.userAuthUrl, headers ={
+        """Verify the token, concurrent verifications of the same token share one outbound call."""
+        if self.jwks_client is not None:
+            return self.verify_user_locally(token)
+
+        key = hashlib.sha256(token.encode()).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self.inflight_lock:
+            pending = self.inflight.get(key)
+            is_leader = pending is None
+            if is_leader:
+                pending = Future()
+                self.inflight[key] = pending
+        if not is_leader:
+            try:
+                # the leader gives up after REQUEST_TIMEOUT, the margin covers its bookkeeping
+                return pending.result(timeout=REQUEST_TIMEOUT + 1)
+            except FutureTimeoutError:
+                return UNAVAILABLE
+
+        try:
+            result = self.__request_verification(token)
+            if result["valid"]:
+                self.cache.put(key, result, self.__cache_expiry(token))
+            pending.set_result(result)
+        except requests.RequestException as e:
+            print(f"Access control service unavailable: {e}")
+            pending.set_result(UNAVAILABLE)
+            result = UNAVAILABLE
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+        return result
+
+    def verify_user_locally(self, token):
+        """Verify signature and expiry of the bearer token without a network hop."""
+        try:
+            encoded = token.split()[-1]
+            signing_key = self.jwks_client.get_signing_key_from_jwt(encoded)
+            claims = jwt.decode(
+                encoded,
+                signing_key.key,
+                algorithms=self.algorithms,
+                options={"verify_aud": False, "require": ["exp"]},
+            )
+        except jwt.ExpiredSignatureError:
+            return {"valid": False, "error_type": "Token expired"}
+        except (jwt.PyJWTError, IndexError):
+            return {"valid": False, "error_type": "Invalid token"}
+        username = claims.get("preferred_username")
+        if not isinstance(username, str) or username == "":
+            return {"valid": False, "error_type": "Token has no preferred_username"}
+        return {"valid": True, "username": username}
+
+    def __request_verification(self, token):
+        r = self.session.get(url = self.userAuthUrl, headers ={
             "Authorization": token
-        })
+        }, timeout=REQUEST_TIMEOUT)
         status=r.status_code
         data = r.json()
-        print("received: ", data)
         if status == 200:
             username = data['preferred_username']
             return {"valid": True, "username": username}
         else:
             return {"valid": False, "error_type": data['type']}
-    
-userAuthHandler = UserAuthHandler()
\ No newline at end of file
+
+    def __cache_expiry(self, token):
+        """Expiry of a cache entry, bounded by the exp claim when the token is a JWT."""
+        expire_at = time.time() + self.cache_ttl
+        try:
+            payload = token.split()[-1].split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return min(expire_at, float(claims["exp"]))
+        except (IndexError, KeyError, TypeError, ValueError):
+            return expire_at
+
+userAuthHandler = LazyInstance(UserAuthHandler)
@@ -0,0 +1,77 @@
+# Buffers the update_at of parent documents and writes them with one bulk $max every
+# FLUSH_INTERVAL seconds. Readers flush the ids they read, the buffer is flushed at exit
+import atexit
+import threading
+import time
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+FLUSH_INTERVAL = 1  # seconds
+# distinct documents waiting for a flush, a full buffer is flushed by the writer
+MAX_PENDING = 10000
+
+
+class WriteBehindBuffer(object):
+    def __init__(self, collection, id_field):
+        self.collection = collection
+        self.id_field = id_field
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.__run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def add(self, doc_id, update_at):
+        with self.lock:
+            self.__merge(doc_id, update_at)
+            full = len(self.pending) >= MAX_PENDING
+        if full:
+            self.flush()
+
+    def __merge(self, doc_id, update_at):
+        current = self.pending.get(doc_id)
+        if current is None or update_at > current:
+            self.pending[doc_id] = update_at
+
+    def has_pending(self):
+        # entries taken by a flush in progress are not written yet
+        return len(self.pending) > 0 or self.flush_lock.locked()
+
+    def flush(self, ids=None):
+        """Write the pending timestamps, only those of the given ids if ids is not None."""
+        with self.flush_lock:
+            with self.lock:
+                if ids is None:
+                    entries, self.pending = self.pending, {}
+                else:
+                    entries = {
+                        doc_id: self.pending.pop(doc_id) for doc_id in ids if doc_id in self.pending
+                    }
+            if len(entries) == 0:
+                return
+            requests = [
+                UpdateOne(
+                    {self.id_field: doc_id},
+                    {"$max": {"update_at": update_at}, "$inc": {"revision": 1}},
+                )
+                for doc_id, update_at in entries.items()
+            ]
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+            except PyMongoError as e:
+                print(f"Error flushing update_at: {e}")
+                # retried with the next flush
+                with self.lock:
+                    for doc_id, update_at in entries.items():
+                        self.__merge(doc_id, update_at)
+
+    def __run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
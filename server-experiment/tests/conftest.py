@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service modules import each other by name, as when run.py is started from src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
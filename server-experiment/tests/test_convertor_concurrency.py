@@ -0,0 +1,94 @@
+"""Concurrent conversions must not share state.
+
+The EMF service is replaced by a stub that echoes the converted model back,
+and nanoid by a per-thread counter that restarts with every conversion, so
+that a conversion gives the same JSON whichever thread runs it. Conversions
+run serially, then again on a thread pool, and must produce the same output.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+import convertorHandler
+from convertorHandler import ConvertorHandler
+
+EXPERIMENTS = 200
+THREADS = 32
+REPEAT = 5
+
+
+class StubResponse(object):
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def stub_get(url, **kwargs):
+    if "Generic" in url:
+        return StubResponse({"data": {"$type": "http://meta/Generic#//Specification"}})
+    return StubResponse({"data": "<xmi/>"})
+
+
+def stub_post(url, params=None, data=None, **kwargs):
+    return StubResponse({"type": "success", "data": json.loads(data)["data"]})
+
+
+ids = threading.local()
+
+
+def deterministic_generate(size=21):
+    ids.count = getattr(ids, "count", 0) + 1
+    return f"{ids.count:0{size}d}"[-size:]
+
+
+@pytest.fixture
+def convertor(monkeypatch):
+    monkeypatch.setattr(requests, "get", stub_get)
+    monkeypatch.setattr(requests, "post", stub_post)
+    monkeypatch.setattr(requests, "delete", lambda *args, **kwargs: None)
+    monkeypatch.setattr(convertorHandler, "generate", deterministic_generate)
+    return ConvertorHandler()
+
+
+def experiment(i):
+    # 1 to 3 tasks with 1 to 3 variants each, so the experiments differ in shape
+    nodes = [{"id": "start", "type": "start"}, {"id": "end", "type": "end"}]
+    for t in range(1 + i % 3):
+        variants = [
+            {
+                "id_task": f"task-{i}-{t}-{v}",
+                "name": f"task {i}",
+                "is_composite": False,
+                "parameters": [
+                    {
+                        "id": "p",
+                        "name": "p",
+                        "type": ["integer", "real", "string"][v % 3],
+                        "values": [1, 2],
+                    }
+                ],
+            }
+            for v in range(1 + (i + t) % 3)
+        ]
+        nodes.append({"id": f"t{t}", "type": "task", "data": {"variants": variants}})
+    edges = [{"id": "link", "source": "start", "target": "end", "type": "regular"}]
+    return {"name": f"experiment {i}", "graphical_model": {"nodes": nodes, "edges": edges}}
+
+
+def test_concurrent_conversions_match_serial(convertor):
+    def convert(i):
+        ids.count = 0
+        return json.dumps(convertor.convert(experiment(i)), sort_keys=True)
+
+    serial = [convert(i) for i in range(EXPERIMENTS)]
+    assert len(set(serial)) == EXPERIMENTS
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        concurrent = list(executor.map(convert, list(range(EXPERIMENTS)) * REPEAT))
+    for index, output in enumerate(concurrent):
+        assert output == serial[index % EXPERIMENTS], f"experiment {index % EXPERIMENTS}"
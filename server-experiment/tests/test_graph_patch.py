@@ -0,0 +1,294 @@
+"""Translation of JSON Patch operations and their in-memory application.
+
+The pure functions are tested without a database. The same patches are also
+sent as MongoDB updates to the server at EXP_TEST_MONGO_URI, when it is set,
+to check that apply_operation gives the graph the update gives.
+"""
+
+import copy
+import os
+import pymongo
+import pytest
+from graphPatch import (
+    PatchError,
+    apply_operation,
+    apply_patch,
+    build_update_stages,
+    parse_pointer,
+    translate,
+)
+
+MONGO_URI = os.environ.get("EXP_TEST_MONGO_URI")
+TEST_DB = "exp_test_graph_patch"
+
+GRAPH = {
+    "name": "graph",
+    "nodes": [
+        {"id": "n1", "type": "task", "position": {"x": 0, "y": 0}, "data": {"label": "a"}},
+        {"id": "n2", "type": "task", "position": {"x": 1, "y": 1}},
+    ],
+    "edges": [{"id": "e1", "source": "n1", "target": "n2"}],
+}
+NODE = {"id": "n3", "type": "task"}
+EDGE = {"id": "e2", "source": "n2", "target": "n3"}
+
+
+def patched(change):
+    graph = copy.deepcopy(GRAPH)
+    change(graph)
+    return graph
+
+
+# (operations, expected graph), each applied to GRAPH
+CASES = {
+    "replace a node field": (
+        [{"op": "replace", "path": "/nodes/n1/position", "value": {"x": 5, "y": 6}}],
+        patched(lambda g: g["nodes"][0].update(position={"x": 5, "y": 6})),
+    ),
+    "replace a node": (
+        [{"op": "replace", "path": "/nodes/n2", "value": {"id": "n2", "type": "end"}}],
+        patched(lambda g: g["nodes"].__setitem__(1, {"id": "n2", "type": "end"})),
+    ),
+    "append nodes": (
+        [
+            {"op": "add", "path": "/nodes/-", "value": NODE},
+            {"op": "add", "path": "/nodes/-", "value": {"id": "n4"}},
+        ],
+        patched(lambda g: g["nodes"].extend([NODE, {"id": "n4"}])),
+    ),
+    "remove an edge": (
+        [{"op": "remove", "path": "/edges/e1"}],
+        patched(lambda g: g["edges"].clear()),
+    ),
+    "add and remove on both arrays": (
+        [
+            {"op": "add", "path": "/nodes/-", "value": NODE},
+            {"op": "remove", "path": "/edges/e1"},
+        ],
+        patched(lambda g: (g["nodes"].append(NODE), g["edges"].clear())),
+    ),
+    "add and remove edges": (
+        [
+            {"op": "add", "path": "/edges/-", "value": EDGE},
+            {"op": "remove", "path": "/edges/e1"},
+        ],
+        patched(lambda g: g.update(edges=[EDGE])),
+    ),
+    "remove a node field": (
+        [{"op": "remove", "path": "/nodes/n1/data/label"}],
+        patched(lambda g: g["nodes"][0].update(data={})),
+    ),
+    "add a nested node field": (
+        [{"op": "add", "path": "/nodes/n2/data/label", "value": "b"}],
+        patched(lambda g: g["nodes"][1].update(data={"label": "b"})),
+    ),
+    "replace a graph field": (
+        [{"op": "replace", "path": "/name", "value": "renamed"}],
+        patched(lambda g: g.update(name="renamed")),
+    ),
+    "add a nested graph field": (
+        [{"op": "add", "path": "/meta/owner", "value": "alice"}],
+        patched(lambda g: g.update(meta={"owner": "alice"})),
+    ),
+    "escaped segments": (
+        [
+            {"op": "add", "path": "/nodes/n1/data/a~1b", "value": 1},
+            {"op": "add", "path": "/nodes/n1/data/c~0d", "value": 2},
+            {"op": "add", "path": "/nodes/n1/data/{e}", "value": 3},
+        ],
+        patched(lambda g: g["nodes"][0]["data"].update({"a/b": 1, "c~d": 2, "{e}": 3})),
+    ),
+}
+
+INVALID = {
+    "missing node": [{"op": "replace", "path": "/nodes/n9/position", "value": {}}],
+    "missing edge": [{"op": "remove", "path": "/edges/e9"}],
+    "missing node field": [{"op": "replace", "path": "/nodes/n2/data/label", "value": "b"}],
+    "missing graph field": [{"op": "replace", "path": "/description", "value": "d"}],
+    "missing element among others": [
+        {"op": "replace", "path": "/nodes/n1/position", "value": {}},
+        {"op": "remove", "path": "/edges/e9"},
+    ],
+}
+
+
+def apply_in_memory(operations):
+    graph = copy.deepcopy(GRAPH)
+    for operation in operations:
+        apply_operation(graph, operation)
+    return graph
+
+
+def test_parse_pointer_unescapes():
+    assert parse_pointer("/nodes/a~1b/c~0d") == ["nodes", "a/b", "c~d"]
+    # ~01 is ~1, not /
+    assert parse_pointer("/x~01") == ["x~1"]
+
+
+@pytest.mark.parametrize("path", ["nodes", "/", "/a//b", "/a.b", "/$set", 3])
+def test_parse_pointer_rejects(path):
+    with pytest.raises(PatchError):
+        parse_pointer(path)
+
+
+def test_translate():
+    assert translate({"op": "add", "path": "/nodes/-", "value": NODE}) == (
+        "$push",
+        "graphical_model.nodes",
+        NODE,
+        None,
+    )
+    assert translate({"op": "remove", "path": "/edges/e1"}) == (
+        "$pull",
+        "graphical_model.edges",
+        "e1",
+        None,
+    )
+    assert translate({"op": "remove", "path": "/name"}) == (
+        "$unset",
+        "graphical_model.name",
+        "",
+        None,
+    )
+    # braces of the path are escaped, the placeholder takes the array filter identifier
+    assert translate({"op": "replace", "path": "/nodes/n1/{x}", "value": 1}) == (
+        "$set",
+        "graphical_model.nodes.$[{}].{{x}}",
+        1,
+        ("nodes", "n1"),
+    )
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        {"op": "replace", "path": "/nodes/-", "value": NODE},
+        {"op": "remove", "path": "/nodes/-"},
+        {"op": "add", "path": "/nodes/-/data", "value": 1},
+        {"op": "move", "path": "/name", "from": "/title"},
+        {"op": "add", "path": "/name"},
+        "add",
+    ],
+)
+def test_invalid_operations(operation):
+    with pytest.raises(PatchError):
+        build_update_stages([operation])
+
+
+def test_single_stage():
+    stages = build_update_stages(CASES["add and remove on both arrays"][0])
+    assert len(stages) == 1
+    assert stages[0].operators == {
+        "$push": {"graphical_model.nodes": {"$each": [NODE]}},
+        "$pull": {"graphical_model.edges": {"id": {"$in": ["e1"]}}},
+    }
+    assert stages[0].query() == {"graphical_model.edges.id": {"$all": ["e1"]}}
+
+
+def test_array_filters():
+    operations = [
+        {"op": "replace", "path": "/nodes/n1/position", "value": {"x": 5}},
+        {"op": "remove", "path": "/nodes/n1/data/label"},
+        {"op": "add", "path": "/nodes/n2/data/{x}", "value": 1},
+    ]
+    (stage,) = build_update_stages(operations)
+    # one identifier per element, reused by the operations on the same element
+    assert stage.array_filters == [{"e0.id": "n1"}, {"e1.id": "n2"}]
+    assert stage.operators == {
+        "$set": {
+            "graphical_model.nodes.$[e0].position": {"x": 5},
+            "graphical_model.nodes.$[e1].data.{x}": 1,
+        },
+        "$unset": {"graphical_model.nodes.$[e0].data.label": ""},
+    }
+    assert stage.query() == {
+        "graphical_model.nodes.id": {"$all": ["n1", "n2"]},
+        "$and": [
+            {
+                "graphical_model.nodes": {
+                    "$elemMatch": {"id": "n1", "position": {"$exists": True}}
+                }
+            }
+        ],
+    }
+
+
+def test_pushes_and_pulls_are_merged():
+    (stage,) = build_update_stages(
+        [
+            {"op": "add", "path": "/edges/-", "value": EDGE},
+            {"op": "add", "path": "/edges/-", "value": {"id": "e3"}},
+        ]
+    )
+    assert stage.operators == {"$push": {"graphical_model.edges": {"$each": [EDGE, {"id": "e3"}]}}}
+    (stage,) = build_update_stages(
+        [{"op": "remove", "path": "/edges/e1"}, {"op": "remove", "path": "/edges/e2"}]
+    )
+    assert stage.operators == {"$pull": {"graphical_model.edges": {"id": {"$in": ["e1", "e2"]}}}}
+    assert stage.query() == {"graphical_model.edges.id": {"$all": ["e1", "e2"]}}
+
+
+def test_conflicting_operations_split_stages():
+    assert len(build_update_stages(CASES["add and remove edges"][0])) == 2
+    operations = [
+        {"op": "add", "path": "/meta", "value": {}},
+        {"op": "add", "path": "/meta/owner", "value": "alice"},
+    ]
+    assert len(build_update_stages(operations)) == 2
+
+
+def test_removing_an_element_twice():
+    operations = [{"op": "remove", "path": "/edges/e1"}, {"op": "remove", "path": "/edges/e1"}]
+    with pytest.raises(PatchError):
+        build_update_stages(operations)
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_apply_operation(name):
+    operations, expected = CASES[name]
+    assert apply_in_memory(operations) == expected
+
+
+@pytest.mark.parametrize("name", INVALID)
+def test_apply_operation_rejects(name):
+    with pytest.raises(PatchError):
+        apply_in_memory(INVALID[name])
+
+
+@pytest.fixture(scope="module")
+def collection():
+    if MONGO_URI is None:
+        pytest.skip("EXP_TEST_MONGO_URI is not set")
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        pytest.skip(f"MongoDB not reachable: {e}")
+    client.drop_database(TEST_DB)
+    yield client[TEST_DB].experiment
+    client.drop_database(TEST_DB)
+    client.close()
+
+
+def insert_graph(collection):
+    document = {"graphical_model": copy.deepcopy(GRAPH), "revision": 0}
+    return collection.insert_one(document).inserted_id
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_update_matches_apply_operation(collection, name):
+    operations, expected = CASES[name]
+    document_id = insert_graph(collection)
+    assert apply_patch(collection, {"_id": document_id}, 0, operations, 1) == 1
+    document = collection.find_one({"_id": document_id})
+    assert document["graphical_model"] == apply_in_memory(operations) == expected
+
+
+@pytest.mark.parametrize("name", INVALID)
+def test_update_rejects(collection, name):
+    document_id = insert_graph(collection)
+    with pytest.raises(PatchError):
+        apply_patch(collection, {"_id": document_id}, 0, INVALID[name], 1)
+    document = collection.find_one({"_id": document_id})
+    assert document["graphical_model"] == GRAPH
+    assert document["revision"] == 0
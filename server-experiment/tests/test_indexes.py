@@ -0,0 +1,352 @@
+"""Every query of the handlers must be answered from an index.
+
+The handler methods run against collections that record the filter,
+projection, sort and limit of each query they send. The recorded queries are
+then explained. explain() needs a real server, mongomock does not plan
+queries: the tests run against the MongoDB at EXP_TEST_MONGO_URI and are
+skipped when it is not set. They use a throwaway database dropped afterwards.
+"""
+
+import os
+import threading
+import pymongo
+import pytest
+import categoryHandler as category_module
+import experimentHandler as experiment_module
+import officialCatalog as catalog_module
+import taskHandler as task_module
+from categoryHandler import CategoryHandler
+from experimentHandler import ExperimentHandler
+from officialCatalog import OfficialCatalog
+from pagination import encode_cursor
+from projectHandler import ProjectHandler
+from reaper import DeletionKind, Reaper
+from taskHandler import TaskHandler
+
+MONGO_URI = os.environ.get("EXP_TEST_MONGO_URI")
+TEST_DB = "exp_test_indexes"
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src")
+
+pytestmark = pytest.mark.skipif(MONGO_URI is None, reason="EXP_TEST_MONGO_URI is not set")
+
+
+class RecordedQuery(object):
+    def __init__(self, collection, method, filter, projection=None):
+        self.collection = collection
+        self.method = method
+        self.filter = filter
+        self.projection = projection
+        self.sort = None
+        self.limit = 0
+
+    def explain(self):
+        cursor = self.collection.find(self.filter, self.projection)
+        if self.sort is not None:
+            cursor = cursor.sort(self.sort)
+        return cursor.limit(self.limit).explain()
+
+    def __repr__(self):
+        return f"{self.method}({self.filter}, {self.projection}) sort={self.sort}"
+
+
+class RecordingCursor(object):
+    def __init__(self, cursor, query):
+        self.cursor = cursor
+        self.query = query
+
+    def sort(self, key_or_list, direction=None):
+        self.query.sort = key_or_list if direction is None else [(key_or_list, direction)]
+        self.cursor = self.cursor.sort(self.query.sort)
+        return self
+
+    def limit(self, limit):
+        self.query.limit = limit
+        self.cursor = self.cursor.limit(limit)
+        return self
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getitem__(self, index):
+        return self.cursor[index]
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class RecordingCollection(object):
+    """Forwards to a collection and records the filter of every read, update and delete."""
+
+    def __init__(self, collection, queries):
+        self.collection = collection
+        self.queries = queries
+
+    def __record(self, method, filter, projection=None):
+        query = RecordedQuery(self.collection, method, filter, projection)
+        self.queries.append(query)
+        return query
+
+    def find(self, filter=None, projection=None, **kwargs):
+        query = self.__record("find", filter, projection)
+        return RecordingCursor(self.collection.find(filter, projection, **kwargs), query)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        self.__record("find_one", filter, projection)
+        return self.collection.find_one(filter, projection, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        if name not in ("update_one", "update_many", "replace_one", "delete_one", "delete_many"):
+            return method
+
+        def recorded(filter, *args, **kwargs):
+            self.__record(name, filter)
+            return method(filter, *args, **kwargs)
+
+        return recorded
+
+
+class PassThroughBlobStore(object):
+    def hydrate_document(self, document):
+        return document
+
+    def dehydrate_graph(self, graph):
+        return graph
+
+
+class EmptyCatalog(object):
+    def get_categories(self):
+        return ()
+
+    def get_tasks(self, category_id):
+        return ()
+
+    def get_version(self):
+        return "test"
+
+
+@pytest.fixture(scope="module")
+def db():
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        pytest.skip(f"MongoDB not reachable: {e}")
+    client.drop_database(TEST_DB)
+    yield client[TEST_DB]
+    client.drop_database(TEST_DB)
+    client.close()
+
+
+@pytest.fixture
+def queries():
+    return []
+
+
+@pytest.fixture
+def handlers(db, queries, monkeypatch):
+    # the handlers are built without their constructors, which connect to the service database
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    project = ProjectHandler.__new__(ProjectHandler)
+    project.collection_project = RecordingCollection(db.project, queries)
+    project.update_at_buffer = None
+    project.init_indexes()
+    experiment = ExperimentHandler.__new__(ExperimentHandler)
+    experiment.collection_experiment = RecordingCollection(db.experiment, queries)
+    experiment.init_indexes()
+    category = CategoryHandler.__new__(CategoryHandler)
+    category.collection_category = RecordingCollection(db.category, queries)
+    category.init_indexes()
+    task = TaskHandler.__new__(TaskHandler)
+    task.collection_task = RecordingCollection(db.task, queries)
+    task.init_indexes()
+    reaper = Reaper.__new__(Reaper)
+    reaper.collection_job = RecordingCollection(db.deletion_job, queries)
+    reaper.kinds = {
+        "project": DeletionKind(
+            project.collection_project,
+            "id_project",
+            experiment.collection_experiment,
+            "project_id",
+        ),
+        "category": DeletionKind(
+            category.collection_category, "id_category", task.collection_task, "category_id"
+        ),
+    }
+    reaper.init_indexes()
+    catalog = OfficialCatalog.__new__(OfficialCatalog)
+    catalog.collection_category = category.collection_category
+    catalog.collection_task = task.collection_task
+    catalog.collection_meta = RecordingCollection(db.meta, queries)
+    catalog.lock = threading.Lock()
+    catalog.init_indexes()
+
+    for module in (experiment_module, task_module, catalog_module):
+        monkeypatch.setattr(module, "blobStore", PassThroughBlobStore())
+    for module in (category_module, task_module):
+        monkeypatch.setattr(module, "officialCatalog", EmptyCatalog())
+    monkeypatch.setattr(experiment_module, "projectHandler", project)
+
+    # a few documents, the planner answers queries on empty collections with EOF
+    for i in range(20):
+        db.project.insert_one(
+            {
+                "id_project": f"p{i}",
+                "owner": f"u{i % 2}",
+                "name": f"p{i}",
+                "update_at": i,
+                "revision": 0,
+            }
+        )
+        db.experiment.insert_one(
+            {
+                "id_experiment": f"e{i}",
+                "project_id": f"p{i % 4}",
+                "name": f"e{i}",
+                "update_at": i,
+                "graphical_model": {"nodes": [], "edges": []},
+                "revision": 0,
+            }
+        )
+        db.category.insert_one(
+            {
+                "id_category": f"c{i}",
+                "owner": f"u{i % 2}",
+                "name": f"c{i}",
+                "is_official": i < 5,
+                "revision": 0,
+            }
+        )
+        db.task.insert_one(
+            {
+                "id_task": f"t{i}",
+                "category_id": f"c{i % 4}",
+                "owner": f"u{i % 2}",
+                "name": f"t{i}",
+                "is_user_defined": i >= 5,
+                "graphical_model": {"nodes": [], "edges": []},
+                "revision": 0,
+            }
+        )
+        db.deletion_job.insert_one(
+            {"_id": f"project:p{i}", "kind": "project", "parent_id": f"p{i}", "status": "pending"}
+        )
+    queries.clear()
+    return {
+        "project": project,
+        "experiment": experiment,
+        "category": category,
+        "task": task,
+        "reaper": reaper,
+        "catalog": catalog,
+    }
+
+
+def stages(plan):
+    """All stage names of an explain() output, whatever the server version nests them in."""
+    if isinstance(plan, dict):
+        found = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            found += stages(value)
+        return found
+    if isinstance(plan, list):
+        return [stage for value in plan for stage in stages(value)]
+    return []
+
+
+def assert_indexed(queries):
+    assert len(queries) > 0
+    for query in queries:
+        found = stages(query.explain()["queryPlanner"]["winningPlan"])
+        assert "COLLSCAN" not in found, (query, found)
+        assert "IXSCAN" in found or "IDHACK" in found or "EXPRESS_IXSCAN" in found, (query, found)
+        if query.sort is not None:
+            # a SORT stage is an in-memory sort
+            assert "SORT" not in found, (query, found)
+
+
+def test_project_queries(handlers, queries):
+    project = handlers["project"]
+    project.get_projects("u0")
+    project.get_projects("u0", summary=True, limit=5, after=encode_cursor(10, "p10"))
+    project.get_projects_versions("u0")
+    project.get_project("p1")
+    project.project_exists("p1")
+    project.get_owned_project_ids("u0", ["p2", "p4"])
+    project.update_project_info("p2", "renamed", "description")
+    project.update_project_update_at("p3")
+    project.delete_project("p19")
+    assert_indexed(queries)
+
+
+def test_experiment_queries(handlers, queries):
+    experiment = handlers["experiment"]
+    experiment.get_experiments("p1")
+    experiment.get_experiments("p1", summary=True, limit=5, after=encode_cursor(10, "e10"))
+    experiment.experiment_exists("e1")
+    experiment.get_experiment("e1")
+    experiment.get_experiment_revision("e1")
+    experiment.update_experiment_name("e1", "p1", "renamed")
+    experiment.update_experiment_graphical_model("e2", "p2", {"nodes": [], "edges": []})
+    experiment.patch_experiment_graphical_model(
+        "e3", "p3", 0, [{"op": "add", "path": "/nodes/-", "value": {"id": "n"}}]
+    )
+    experiment.bulk_experiments(
+        "u1",
+        "p1",
+        [
+            {"op": "update", "id_experiment": "e5", "exp_name": "moved", "project_id": "p3"},
+            {"op": "delete", "id_experiment": "e9"},
+        ],
+    )
+    experiment.delete_experiment("e13", "p1")
+    experiment.delete_experiments("p2")
+    assert_indexed(queries)
+
+
+def test_category_queries(handlers, queries):
+    category = handlers["category"]
+    category.get_categories("u0")
+    category.get_categories_versions("u0")
+    category.get_category("c1")
+    category.category_exists("c1")
+    category.update_category_name("c6", "renamed")
+    category.delete_category("c19")
+    assert_indexed(queries)
+
+
+def test_task_queries(handlers, queries):
+    task = handlers["task"]
+    task.get_tasks("c1", "u0")
+    task.get_tasks("c1", "u0", summary=True)
+    task.get_tasks_versions("c1", "u0")
+    task.get_catalog([{"id_category": "c1"}], "u0")
+    task.get_user_tasks_versions("u0")
+    task.get_task_version("t1")
+    task.task_exists("t1")
+    task.get_task("t1")
+    task.update_task_info("t6", "renamed", "description")
+    task.update_task_graphical_model("t7", {"nodes": [], "edges": []})
+    task.patch_task_graphical_model(
+        "t8", 0, [{"op": "add", "path": "/nodes/-", "value": {"id": "n"}}]
+    )
+    task.delete_task("t19")
+    task.delete_tasks("c3")
+    assert_indexed(queries)
+
+
+def test_reaper_queries(handlers, queries, monkeypatch):
+    monkeypatch.setattr("reaper.BATCH_PAUSE", 0)
+    reaper = handlers["reaper"]
+    job = next(iter(reaper.pending_jobs()))
+    reaper.reap(job)
+    reaper.get_job("project", job["parent_id"])
+    assert_indexed(queries)
+
+
+def test_official_catalog_queries(handlers, queries, monkeypatch):
+    # the seed file path is relative to src, where run.py is started
+    monkeypatch.chdir(SRC_DIR)
+    handlers["catalog"].seed()
+    assert_indexed(queries)
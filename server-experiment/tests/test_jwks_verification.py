@@ -0,0 +1,122 @@
+"""Local token verification against a stub JWKS endpoint.
+
+The key pairs are generated by the test and their public keys are served by
+an HTTP server on localhost, as the identity provider would.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from userAuthHandler import UserAuthHandler
+
+
+def generate_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update({"kid": kid, "use": "sig", "alg": "RS256"})
+    return private_key, public_jwk
+
+
+class StubJWKS(object):
+    def __init__(self):
+        self.keys = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                body = json.dumps({"keys": stub.keys}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/certs"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return {kid: generate_key(kid) for kid in ("first", "rotated", "unpublished")}
+
+
+@pytest.fixture
+def jwks(keys):
+    stub = StubJWKS()
+    stub.keys = [keys["first"][1]]
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def handler(jwks, monkeypatch):
+    monkeypatch.setenv("EXP_AUTH_MODE", "jwks")
+    monkeypatch.setenv("OIDC_OP_JWKS_ENDPOINT", jwks.url)
+    monkeypatch.delenv("OIDC_RP_SIGN_ALGO", raising=False)
+    return UserAuthHandler()
+
+
+def sign(keys, kid, **claims):
+    claims.setdefault("exp", int(time.time()) + 300)
+    token = jwt.encode(claims, keys[kid][0], algorithm="RS256", headers={"kid": kid})
+    return f"Bearer {token}"
+
+
+def test_valid_token(handler, keys, jwks):
+    token = sign(keys, "first", preferred_username="alice")
+    assert handler.verify_user(token) == {"valid": True, "username": "alice"}
+    assert handler.verify_user(token)["username"] == "alice"
+    # the key set is cached
+    assert jwks.requests == 1
+
+
+def test_expired_token(handler, keys):
+    token = sign(keys, "first", preferred_username="alice", exp=int(time.time()) - 60)
+    assert handler.verify_user(token) == {"valid": False, "error_type": "Token expired"}
+
+
+def test_token_without_username(handler, keys):
+    result = handler.verify_user(sign(keys, "first", sub="alice"))
+    assert result["valid"] is False
+    assert "error_type" in result
+
+
+def test_unknown_key(handler, keys):
+    result = handler.verify_user(sign(keys, "unpublished", preferred_username="alice"))
+    assert result == {"valid": False, "error_type": "Invalid token"}
+
+
+def test_forged_signature(handler, keys):
+    # signed with another key under the kid of a published one
+    claims = {"preferred_username": "alice", "exp": int(time.time()) + 300}
+    forged = jwt.encode(claims, keys["rotated"][0], algorithm="RS256", headers={"kid": "first"})
+    assert handler.verify_user(f"Bearer {forged}")["valid"] is False
+
+
+def test_key_set_refetched_on_unknown_kid(handler, keys, jwks):
+    assert handler.verify_user(sign(keys, "first", preferred_username="alice"))["valid"]
+    jwks.keys = [keys["first"][1], keys["rotated"][1]]
+    result = handler.verify_user(sign(keys, "rotated", preferred_username="bob"))
+    assert result == {"valid": True, "username": "bob"}
+    assert jwks.requests == 2
+
+
+def test_empty_algorithm_setting(jwks, keys, monkeypatch):
+    # docker-compose passes an unset variable as an empty string
+    monkeypatch.setenv("EXP_AUTH_MODE", "jwks")
+    monkeypatch.setenv("OIDC_OP_JWKS_ENDPOINT", jwks.url)
+    monkeypatch.setenv("OIDC_RP_SIGN_ALGO", "")
+    handler = UserAuthHandler()
+    assert handler.algorithms == ["RS256"]
+    assert handler.verify_user(sign(keys, "first", preferred_username="alice"))["valid"]